@@ -0,0 +1,51 @@
+# Tools/_build_world_backends/__init__.py
+#
+# Text-generation backends for Tools/build_world.py. Each backend module exposes
+# `generate_world_json(facts_json: str) -> str`, returning the raw model reply;
+# parsing, defaults and caching stay in build_world itself.
+
+import importlib
+from typing import Callable
+
+SYSTEM_PROMPT = "You convert structured facts into world-building JSON."
+USER_PROMPT = """
+You are a world-building assistant. Given these structured facts:
+
+{facts_json}
+
+Generate a JSON object with exactly these fields:
+  1) setting_description: a 2–3 sentence vivid paragraph describing the environment.
+  2) flora: a list of 3–5 plant species commonly found here.
+  3) fauna: a list of 3–5 animals or creatures one might encounter.
+  4) ambiance: a list of 3–5 sensory details (sounds, smells, tactile feelings).
+
+Return ONLY valid JSON with those four keys.
+"""
+# JSON schema of the reply, for backends that can constrain decoding to it
+WORLD_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "setting_description": {"type": "string"},
+        "flora": {"type": "array", "items": {"type": "string"}},
+        "fauna": {"type": "array", "items": {"type": "string"}},
+        "ambiance": {"type": "array", "items": {"type": "string"}}
+    },
+    "required": ["setting_description", "flora", "fauna", "ambiance"]
+}
+
+# Backend name -> module; modules are imported on first use, so choosing a
+# remote backend never pulls in (or loads) the local model.
+_BACKENDS = {
+    "local": "local",
+    "inference_client": "inference_client",
+}
+
+
+def get_backend(name: str) -> Callable[[str], str]:
+    """
+    Returns the `generate_world_json` function of backend `name`.
+    """
+    if name not in _BACKENDS:
+        raise ValueError(f"Unknown build_world backend {name!r}; expected one of {sorted(_BACKENDS)}.")
+    module = importlib.import_module(f"{__name__}.{_BACKENDS[name]}")
+    return module.generate_world_json
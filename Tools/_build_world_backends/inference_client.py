@@ -0,0 +1,60 @@
+# Tools/_build_world_backends/inference_client.py
+
+import functools
+import os
+from huggingface_hub import AsyncInferenceClient
+from async_utils import run_async_safely
+from llm_utils import parse_json_prefix
+from . import SYSTEM_PROMPT, USER_PROMPT, WORLD_SCHEMA
+
+WORLD_MODEL = os.getenv("WORLD_MODEL", "mistralai/Mistral-7B-Instruct-v0.3")
+REQUEST_TIMEOUT = 60  # seconds
+
+
+@functools.lru_cache(maxsize=1)
+def _get_client() -> AsyncInferenceClient:
+    # Created on first use, so importing this backend never needs a token
+    token = os.getenv("HUGGINGFACE_API_TOKEN", "")
+    if not token:
+        raise RuntimeError("Please set HUGGINGFACE_API_TOKEN in your environment.")
+    return AsyncInferenceClient(model=WORLD_MODEL, token=token, timeout=REQUEST_TIMEOUT)
+
+
+async def agenerate_world_json(facts_json: str) -> str:
+    """
+    Generates the world JSON through the Hugging Face Inference API without
+    blocking the event loop, so callers can gather it with other requests.
+    The reply is streamed and the stream closed as soon as it holds a complete
+    JSON object, instead of waiting for any trailing text.
+    """
+    parts = []
+    stream = await _get_client().chat_completion(
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user",   "content": USER_PROMPT.replace("{facts_json}", facts_json)}
+        ],
+        temperature=0.7,
+        max_tokens=200,
+        # Grammar-constrained decoding: the endpoint can only emit schema-valid JSON
+        response_format={"type": "json", "value": WORLD_SCHEMA},
+        stream=True
+    )
+    try:
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            parts.append(delta)
+            if "}" in delta and parse_json_prefix("".join(parts), "{") is not None:
+                break
+    finally:
+        # Closes the HTTP response, which ends generation on the server
+        await stream.aclose()
+    return "".join(parts)
+
+
+def generate_world_json(facts_json: str) -> str:
+    """
+    Sync entry point used by build_world; runs on the shared background loop.
+    """
+    return run_async_safely(agenerate_world_json(facts_json))
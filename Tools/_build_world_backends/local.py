@@ -0,0 +1,41 @@
+# Tools/_build_world_backends/local.py
+
+import torch
+from transformers import StoppingCriteriaList
+from llm_utils import LLM_BACKEND, JSONCompleteStop, closing_eos_ids, encode_chat, generate_batch, generate_static, get_llm, release_cuda_cache
+from . import SYSTEM_PROMPT, USER_PROMPT, WORLD_SCHEMA
+
+
+def generate_world_json(facts_json: str) -> str:
+    """
+    Generates the world JSON with the shared local Mistral model (loaded on first use).
+    With STORY_LLM_BACKEND=vllm the shared vLLM engine generates it instead, so a
+    second copy of the model is never loaded next to the engine.
+    """
+    if LLM_BACKEND == "vllm":
+        return generate_batch(
+            SYSTEM_PROMPT, USER_PROMPT, [{"facts_json": facts_json}], json_schema=WORLD_SCHEMA, max_new_tokens=200
+        )[0]
+
+    # 1) Tokenize (only the facts; the template around them is cached) & move to device
+    tokenizer, model = get_llm()
+    input_ids = encode_chat(SYSTEM_PROMPT, USER_PROMPT, facts_json=facts_json)
+    inputs = {
+        "input_ids": input_ids.to(model.device),
+        "attention_mask": torch.ones_like(input_ids).to(model.device)
+    }
+
+    # 2) Greedy-decode up to 200 new tokens, stopping once the JSON object is complete
+    prompt_len = inputs["input_ids"].shape[-1]
+    outputs = generate_static(
+        inputs["input_ids"],
+        attention_mask=inputs["attention_mask"],
+        max_new_tokens=200,
+        eos_token_id=closing_eos_ids(tokenizer, "}"),
+        stopping_criteria=StoppingCriteriaList([JSONCompleteStop(tokenizer, prompt_len, "{")])
+    )
+    release_cuda_cache()
+
+    # 3) Slice off the prompt tokens and decode
+    gen_ids = outputs[0][prompt_len:]
+    return tokenizer.decode(gen_ids, skip_special_tokens=True)
@@ -1,24 +1,157 @@
 # voice_narration_tool.py
 #-------------libraries to install----------#
 #pip install g2p-en, nltk, smolagents
+import asyncio
+import math
+import re
+from typing import Dict, List
+import numpy as np
 import torch
 import soundfile as sf
-import nltk
 from transformers import FastSpeech2ConformerTokenizer, FastSpeech2ConformerWithHifiGan
 from smolagents import tool
+from async_utils import run_async_safely
+from llm_utils import release_cuda_cache
 import os
 import warnings
 warnings.filterwarnings("ignore")
-nltk.download('all')
+
+# NLTK data the g2p-en phonemizer behind the FastSpeech2 tokenizer needs
+_NLTK_RESOURCES = {
+    "taggers/averaged_perceptron_tagger_eng": "averaged_perceptron_tagger_eng",
+    "corpora/cmudict": "cmudict",
+}
+
+def _ensure_nltk_data() -> None:
+    """Download only the missing NLTK resources g2p-en uses, instead of every corpus."""
+    import nltk
+    for path, package in _NLTK_RESOURCES.items():
+        try:
+            nltk.data.find(path)
+        except LookupError:
+            nltk.download(package, quiet=True)
 
 # ——————————————————————————————
 # Global FastSpeech2 model for voice narration
 VOICE_MODEL = "espnet/fastspeech2_conformer_with_hifigan"
+_ensure_nltk_data()
 _tokenizer_voice = FastSpeech2ConformerTokenizer.from_pretrained("espnet/fastspeech2_conformer")
-_model_voice = FastSpeech2ConformerWithHifiGan.from_pretrained(VOICE_MODEL)
+_device_voice = "cuda" if torch.cuda.is_available() else "cpu"
+_dtype_voice = torch.bfloat16 if torch.cuda.is_available() else torch.float32
+_model_voice = FastSpeech2ConformerWithHifiGan.from_pretrained(VOICE_MODEL, torch_dtype=_dtype_voice).to(_device_voice)
 _model_voice.eval()
+# Resolved once; looking the device up walks the module's parameters
+_DEV = next(_model_voice.parameters()).device
+# Compile the forward on GPU only ("0" keeps it eager); `_model_voice` stays eager for
+# config/device lookups. No CUDA graphs: the mel and waveform lengths follow the
+# predicted durations, so a captured graph would be re-recorded on most calls
+VOICE_COMPILE = os.getenv("VOICE_COMPILE", "1") != "0" and _DEV.type == "cuda"
+_forward_voice = torch.compile(_model_voice, fullgraph=False) if VOICE_COMPILE else _model_voice
+SAMPLE_RATE = 22050  # FastSpeech2 default sample rate
+# Waveform samples produced per predicted duration frame (HiFi-GAN upsampling)
+_HOP_LENGTH = math.prod(_model_voice.config.vocoder_config.upsample_rates)
+_WRITE_CHUNK = 65536  # samples handed to the encoder per write
+# Token lengths are right-padded up to one of these buckets, which bounds the input
+# shapes the compiled encoder sees (longer inputs run unpadded). The output lengths
+# still vary with the predicted durations.
+_SHAPE_BUCKETS = (64, 128, 256, 512, 1024)
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+")
+_CROSSFADE = int(0.010 * SAMPLE_RATE)  # 10 ms overlap between sentence chunks
+# Hann ramps for the crossfade, built once rather than per sentence boundary
+_HANN = np.hanning(2 * _CROSSFADE)
+_FADE_IN, _FADE_OUT = _HANN[:_CROSSFADE], _HANN[_CROSSFADE:]
 # ——————————————————————————————
 
+def _pad_to(inputs: Dict[str, torch.Tensor], length: int) -> Dict[str, torch.Tensor]:
+    """Right-pad tokenizer output to `length`; padded positions are masked out."""
+    pad = length - inputs["input_ids"].shape[1]
+    if pad <= 0:
+        return inputs
+    return {
+        "input_ids": torch.nn.functional.pad(inputs["input_ids"], (0, pad), value=_tokenizer_voice.pad_token_id),
+        "attention_mask": torch.nn.functional.pad(inputs["attention_mask"], (0, pad), value=0),
+    }
+
+def _pad_to_bucket(inputs: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+    """Pad tokenizer output to the smallest shape bucket that fits it."""
+    length = inputs["input_ids"].shape[1]
+    bucket = next((b for b in _SHAPE_BUCKETS if b >= length), length)
+    return _pad_to(inputs, bucket)
+
+def _warmup() -> None:
+    """Trace the compiled forward on the smallest bucket, so the first narration skips most of the compile."""
+    inputs = _pad_to(_tokenizer_voice("Once upon a time.", return_tensors="pt"), _SHAPE_BUCKETS[0])
+    with torch.inference_mode():
+        _forward_voice(**{k: v.to(_DEV) for k, v in inputs.items()})
+
+def _synthesize(texts: List[str]) -> List[np.ndarray]:
+    """
+    Run a single padded FastSpeech2 forward over `texts` and return one
+    waveform per text, trimmed to its own predicted length.
+    """
+    inputs = _pad_to_bucket(_tokenizer_voice(texts, return_tensors="pt", padding=True))
+    if _DEV.type == "cuda":
+        # Page-locked host memory lets the host-to-device copy run asynchronously
+        inputs = {k: v.pin_memory().to(_DEV, non_blocking=True) for k, v in inputs.items()}
+    else:
+        inputs = {k: v.to(_DEV) for k, v in inputs.items()}
+
+    with torch.inference_mode():
+        output = _forward_voice(**inputs)
+    release_cuda_cache()
+
+    # Padded tokens get a zero duration, so the summed durations give each row's true length
+    lengths = (output.duration_outputs.sum(dim=-1) * _HOP_LENGTH).tolist()
+    waveforms = output.waveform.float().cpu().numpy()
+    return [wave[:int(n)] for wave, n in zip(waveforms, lengths)]
+
+def _crossfade_concat(chunks: List[np.ndarray]) -> np.ndarray:
+    """
+    Join sentence waveforms with a short Hann crossfade.
+    """
+    pieces = [chunks[0]]
+    for chunk in chunks[1:]:
+        prev = pieces[-1]
+        n = min(_CROSSFADE, len(prev), len(chunk))
+        if n == _CROSSFADE:
+            fade_in, fade_out = _FADE_IN, _FADE_OUT
+        else:
+            # Chunk shorter than the crossfade: fall back to a matching shorter ramp
+            window = np.hanning(2 * n)
+            fade_in, fade_out = window[:n], window[n:]
+        overlap = prev[len(prev) - n:] * fade_out + chunk[:n] * fade_in
+        pieces[-1] = prev[:len(prev) - n]
+        pieces.extend([overlap, chunk[n:]])
+    return np.concatenate(pieces)
+
+def _narrate_sentences(text: str) -> np.ndarray:
+    """
+    Split `text` into sentences, synthesize them as one batch (many short
+    attention spans instead of one long one) and crossfade the results.
+    """
+    sentences = [s for s in _SENTENCE_SPLIT.split(text) if s]
+    return _crossfade_concat(_synthesize(sentences))
+
+def write_audio_to_file(audio: np.ndarray, filename: str) -> int:
+    """
+    Stream `audio` to a 16-bit PCM WAV file in fixed-size blocks, converting
+    each block to int16 on the way so no full-length copy is built; returns
+    the number of samples written.
+    """
+    # Ensure output directory exists
+    os.makedirs(os.path.dirname(filename) if os.path.dirname(filename) else ".", exist_ok=True)
+
+    size = 0
+    with sf.SoundFile(filename, "w", samplerate=SAMPLE_RATE, channels=1, subtype="PCM_16") as f:
+        for i in range(0, len(audio), _WRITE_CHUNK):
+            block = np.clip(audio[i:i + _WRITE_CHUNK] * 32767.0, -32768, 32767).astype(np.int16)
+            f.write(block)
+            size += len(block)
+    return size
+
+if VOICE_COMPILE:
+    _warmup()
+
 @tool
 def generate_voice_narration(text: str, output_filename: str = "narration.wav") -> str:
     """
@@ -37,25 +170,11 @@ def generate_voice_narration(text: str, output_filename: str = "narration.wav")
         if not clean_text:
             return "Error: Empty text provided"
         
-        # Tokenize the input text
-        inputs = _tokenizer_voice(clean_text, return_tensors="pt")
-        
-        # Generate audio
-        with torch.no_grad():
-            # Move inputs to same device as model if needed
-            if torch.cuda.is_available() and next(_model_voice.parameters()).is_cuda:
-                inputs = {k: v.cuda() if isinstance(v, torch.Tensor) else v for k, v in inputs.items()}
-            
-            # Generate speech
-            output = _model_voice(**inputs)
-            audio = output.waveform.squeeze().cpu().numpy()
-        
-        # Ensure output directory exists
-        os.makedirs(os.path.dirname(output_filename) if os.path.dirname(output_filename) else ".", exist_ok=True)
+        # Generate speech sentence by sentence in a single batched pass
+        audio = _narrate_sentences(clean_text)
         
         # Save audio file
-        sample_rate = 22050  # FastSpeech2 default sample rate
-        sf.write(output_filename, audio, samplerate=sample_rate)
+        write_audio_to_file(audio, output_filename)
         
         return f"Voice narration saved to: {output_filename}"
         
@@ -80,35 +199,49 @@ def generate_story_narration(story_text: str, chapter_name: str = "chapter") ->
         if not clean_text:
             return "Error: Empty story text provided"
         
-        # For longer texts, we might want to split into sentences and combine
-        # or just process the whole text at once (FastSpeech2 can handle reasonably long texts)
-        
         output_filename = f"{chapter_name}_narration.wav"
         
-        # Tokenize and generate
-        inputs = _tokenizer_voice(clean_text, return_tensors="pt")
-        
-        with torch.no_grad():
-            # Move to appropriate device
-            if torch.cuda.is_available() and next(_model_voice.parameters()).is_cuda:
-                inputs = {k: v.cuda() if isinstance(v, torch.Tensor) else v for k, v in inputs.items()}
-            
-            # Generate speech
-            output = _model_voice(**inputs)
-            audio = output.waveform.squeeze().cpu().numpy()
+        # Generate speech sentence by sentence in a single batched pass
+        audio = _narrate_sentences(clean_text)
         
         # Save the narration
-        sample_rate = 22050
-        sf.write(output_filename, audio, samplerate=sample_rate)
+        size = write_audio_to_file(audio, output_filename)
         
         # Calculate duration for user feedback
-        duration = len(audio) / sample_rate
+        duration = size / SAMPLE_RATE
         
         return f"Story narration completed! Saved to: {output_filename} (Duration: {duration:.2f} seconds)"
         
     except Exception as e:
         return f"Error generating story narration: {str(e)}"
 
+@tool
+def narrate_stories(stories: List[Dict[str, str]]) -> List[str]:
+    """
+    Generate voice narration for several texts with one batched FastSpeech2 pass.
+    
+    Args:
+        stories (List[Dict[str, str]]): Items with a "text" to narrate and the "filename" to write
+    
+    Returns:
+        List[str]: Path of each generated audio file, in input order
+    """
+    clean_texts = [story["text"].strip() for story in stories]
+    if not all(clean_texts):
+        raise ValueError("Every story needs non-empty text.")
+    
+    audios = _synthesize(clean_texts)
+    
+    # Write all files concurrently on the shared loop
+    async def _write_all():
+        await asyncio.gather(*[
+            asyncio.to_thread(write_audio_to_file, audio, story["filename"])
+            for story, audio in zip(stories, audios)
+        ])
+    run_async_safely(_write_all())
+    
+    return [story["filename"] for story in stories]
+
 if __name__ == "__main__":
     # --- Test Cases ---
     test_texts = [
@@ -124,6 +257,11 @@ if __name__ == "__main__":
         result = generate_voice_narration(text=text, output_filename=f"test_narration_{i}.wav")
         print(f"Result: {result}")
     
+    # Test batched narration
+    batch = [{"text": text, "filename": f"test_batch_{i}.wav"} for i, text in enumerate(test_texts, 1)]
+    print(f"\nTesting batched narration of {len(batch)} texts...")
+    print(f"Batch Result: {narrate_stories(stories=batch)}")
+    
     # Test story narration
     story = " ".join(test_texts)
     print(f"\nTesting story narration with combined text...")
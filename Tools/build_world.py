@@ -1,13 +1,41 @@
 # Tools/build_world.py
 
 from typing import Dict, Any
+from collections import OrderedDict
 from smolagents import tool
-import json
-import torch
-# from llm_utils import tokenizer, model, generate_completion # These are loaded globally elsewhere
+import copy
+import hashlib
+import orjson
+import threading
+from llm_utils import parse_json_prefix
+from Tools._build_world_backends import get_backend
+
+# Content-addressed cache of generated worlds, so revisiting a scene skips the LLM
+_WORLD_CACHE: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_WORLD_CACHE_MAX = 128
+_WORLD_CACHE_LOCK = threading.Lock()
+# Facts that determine the world; a scene without a location is cached by all its facts
+_SETTING_FIELDS = ("location", "weather", "time_of_day")
+
+_WORLD_DEFAULTS = {
+    "setting_description": "",
+    "flora": [],
+    "fauna": [],
+    "ambiance": []
+}
+
+
+def _with_world_defaults(parsed: Any) -> Dict[str, Any]:
+    # Parsed world with any missing keys filled in (the defaults alone on error).
+    # Fresh copies, so callers can't mutate the shared defaults.
+    world_dict = copy.deepcopy(_WORLD_DEFAULTS)
+    if isinstance(parsed, dict):
+        world_dict.update(parsed)
+    return world_dict
+
 
 @tool
-def build_world(facts: Dict[str, Any]) -> Dict[str, Any]:
+def build_world(facts: Dict[str, Any], backend: str = "local") -> Dict[str, Any]:
     """
     Given a structured `facts` dictionary, returns a world-building dictionary with keys:
       - setting_description: a vivid 2–3 sentence paragraph describing the environment.
@@ -17,75 +45,44 @@ def build_world(facts: Dict[str, Any]) -> Dict[str, Any]:
 
     Args:
         facts (Dict[str, Any]): The structured facts extracted from the scene.
+        backend (str): Where to generate: "local" (shared Mistral model) or
+            "inference_client" (Hugging Face Inference API).
 
     Returns:
         Dict[str, Any]: A dictionary with exactly the four keys:
             'setting_description', 'flora', 'fauna', and 'ambiance'.
     """
-    # 1) Prepare the JSON-extraction prompt
-    facts_json = json.dumps(facts, indent=2)
-    prompt = f"""
-You are a world-building assistant. Given these structured facts:
-
-{facts_json}
-
-Generate a JSON object with exactly these fields:
-  1) setting_description: a 2–3 sentence vivid paragraph describing the environment.
-  2) flora: a list of 3–5 plant species commonly found here.
-  3) fauna: a list of 3–5 animals or creatures one might encounter.
-  4) ambiance: a list of 3–5 sensory details (sounds, smells, tactile feelings).
-
-Return ONLY valid JSON with those four keys.
-"""
-
-    # 2) Tokenize & move to device
-    inputs = tokenizer.apply_chat_template(
-        [
-            {"role": "system", "content": "You convert structured facts into world-building JSON."},
-            {"role": "user",   "content": prompt}
-        ],
-        tokenize=True,
-        add_generation_prompt=True,
-        return_tensors="pt",
-        return_dict=True # Keep return_dict=True to get attention_mask
-    )
-    # Move each tensor to the model device
-    for k,v in inputs.items():
-        inputs[k] = v.to(model.device)
-
-    # 3) Generate up to 256 new tokens via shared generate_completion
-    with torch.no_grad():
-        # Pass the input_ids tensor directly and the attention_mask
-        outputs = model.generate(
-            inputs["input_ids"], # Pass the tensor directly
-            max_new_tokens=256,
-            attention_mask=inputs.get("attention_mask") # Pass attention_mask if present
-        )
-
+    # 0) Compact, key-ordered facts JSON: fewer prompt tokens and a stable cache key
+    facts_json = orjson.dumps(facts, option=orjson.OPT_SORT_KEYS).decode()
 
-    # 4) Slice off the prompt tokens
-    prompt_len = inputs["input_ids"].shape[-1]
-    gen_ids    = outputs[0][prompt_len:]
+    # 1) Serve revisited places from the cache: the world depends on where and when
+    #    the scene is set, not on its events, so known settings are keyed by those alone
+    setting = tuple(facts.get(field) for field in _SETTING_FIELDS)
+    if setting[0] is not None:
+        key_source = orjson.dumps(setting).decode()
+    else:
+        key_source = facts_json
+    key = hashlib.blake2b(f"{backend}\0{key_source}".encode(), digest_size=16).hexdigest()
+    with _WORLD_CACHE_LOCK:
+        cached = _WORLD_CACHE.get(key)
+        if cached is not None:
+            _WORLD_CACHE.move_to_end(key)
+    if cached is not None:
+        return copy.deepcopy(cached)
 
-    # 5) Decode the JSON string
-    raw = tokenizer.decode(gen_ids, skip_special_tokens=True)
-    start = raw.find("{")
-    candidate = raw[start:] if start >= 0 else raw
+    # 2) Generate the raw JSON reply with the chosen backend
+    raw = get_backend(backend)(facts_json)
 
-    # 6) Parse, with a defaults fallback
-    defaults = {
-        "setting_description": "",
-        "flora": [],
-        "fauna": [],
-        "ambiance": []
-    }
-    try:
-        world_dict = json.loads(candidate)
-    except Exception:
-        world_dict = defaults.copy()
+    # 3) Parse the first JSON object (trailing text is fine); missing keys get defaults
+    parsed = parse_json_prefix(raw, "{")
+    world_dict = _with_world_defaults(parsed)
 
-    # 7) Ensure all keys are present
-    for key, val in defaults.items():
-        world_dict.setdefault(key, val)
+    # 4) Remember a usable result, evicting the least recently used entry; a failed
+    #    reply is not cached, so the next visit to this setting tries again
+    if isinstance(parsed, dict) and world_dict["setting_description"]:
+        with _WORLD_CACHE_LOCK:
+            _WORLD_CACHE[key] = copy.deepcopy(world_dict)
+            if len(_WORLD_CACHE) > _WORLD_CACHE_MAX:
+                _WORLD_CACHE.popitem(last=False)
 
-    return world_dict
\ No newline at end of file
+    return world_dict
@@ -1,12 +1,58 @@
 # tools.py
 
-from typing import Dict, Any
+from typing import Dict, Any, List
 from smolagents import Tool
-from transformers import AutoTokenizer, AutoModelForCausalLM
-from llm_utils import tokenizer, model, generate_completion
-import torch
-import os
-import json
+from llm_utils import generate_batch, parse_json_prefix
+
+_SYSTEM_PROMPT = "You extract JSON facts."
+_USER_PROMPT = """
+You are a fact-extraction assistant. Extract exactly the following keys and output valid JSON:
+1) location: e.g. "rainy_forest" or null
+2) weather: e.g. "rainy" or null
+3) time_of_day: e.g. "evening" or null
+4) main_character: protagonist name or null
+5) npc_states: dict of other characters → {status, location}, or {}
+6) inventory_items: list of item names, or []
+7) events: 1–2 sentence summary of what happened
+
+Scene:
+\"\"\"
+{scene_text}
+\"\"\"
+"""
+_FACTS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "location": {"type": ["string", "null"]},
+        "weather": {"type": ["string", "null"]},
+        "time_of_day": {"type": ["string", "null"]},
+        "main_character": {"type": ["string", "null"]},
+        "npc_states": {"type": "object"},
+        "inventory_items": {"type": "array", "items": {"type": "string"}},
+        "events": {"type": "string"}
+    },
+    "required": ["location", "weather", "time_of_day", "main_character", "npc_states", "inventory_items", "events"]
+}
+_FACT_DEFAULTS = {
+    "location": None,
+    "weather": None,
+    "time_of_day": None,
+    "main_character": None,
+    "npc_states": {},
+    "inventory_items": [],
+    "events": ""
+}
+
+
+def _with_fact_defaults(parsed: Any) -> Dict[str, Any]:
+    # Merge parsed facts over the defaults (which alone are the fallback on error).
+    # The empty containers are fresh per call so callers can't mutate the shared defaults.
+    return {
+        **_FACT_DEFAULTS,
+        "npc_states": {},
+        "inventory_items": [],
+        **(parsed if isinstance(parsed, dict) else {})
+    }
 
 
 class ExtractFactsTool(Tool):
@@ -32,65 +78,46 @@ class ExtractFactsTool(Tool):
     output_type = "object"
 
     def forward(self, scene_text: str) -> Dict[str, Any]:
-        # 1) Build the instruction + content prompt
-        prompt = f"""
-                    You are a fact-extraction assistant. Extract exactly the following keys and output valid JSON:
-                    1) location: e.g. "rainy_forest" or null
-                    2) weather: e.g. "rainy" or null
-                    3) time_of_day: e.g. "evening" or null
-                    4) main_character: protagonist name or null
-                    5) npc_states: dict of other characters → {{status, location}}, or {{}}
-                    6) inventory_items: list of item names, or []
-                    7) events: 1–2 sentence summary of what happened
-
-                    Scene:
-                    \"\"\"
-                    {scene_text}
-                    \"\"\"
-                  """
-
-        # 2) Tokenize using the chat template
-        # The output of apply_chat_template with return_tensors="pt" is a single tensor.
-        # It does not need to be converted to a dictionary for model.generate.
-        inputs_tensor = tokenizer.apply_chat_template(
-            [{"role":"system","content":"You extract JSON facts."},
-             {"role":"user","content":prompt}],
-            tokenize=True,
-            add_generation_prompt=True,
-            return_tensors="pt"
-        ).to(model.device)
-
-        # 3) Generate up to 256 new tokens
-        with torch.no_grad():
-            # Pass the tensor directly to generate
-            outputs = model.generate(inputs_tensor, max_new_tokens=256)
-
-        # 4) Slice off the prompt tokens
-        input_len = inputs_tensor.size(-1) # Use inputs_tensor to get the original input length
-        gen_ids   = outputs[0][input_len:]
-
-        # 5) Decode and strip out anything before the first '{'
-        raw = tokenizer.decode(gen_ids, skip_special_tokens=True)
-        json_start = raw.find("{")
-        candidate = raw[json_start:] if json_start >= 0 else raw
-
-        # 6) Parse JSON (fallback to defaults on error)
-        defaults = {
-            "location": None,
-            "weather": None,
-            "time_of_day": None,
-            "main_character": None,
-            "npc_states": {},
-            "inventory_items": [],
-            "events": ""
-        }
-        try:
-            fact_dict = json.loads(candidate)
-        except Exception:
-            fact_dict = defaults.copy()
+        return self.forward_batch([scene_text])[0]
+
+    def forward_batch(self, scene_texts: List[str]) -> List[Dict[str, Any]]:
+        """
+        Extracts facts for several scenes with a single batched generate() call.
+        """
+        raws = generate_batch(
+            _SYSTEM_PROMPT,
+            _USER_PROMPT,
+            [{"scene_text": text} for text in scene_texts],
+            json_schema=_FACTS_SCHEMA,
+            max_new_tokens=256
+        )
+        return [self._parse_facts(raw) for raw in raws]
+
+    @staticmethod
+    def _parse_facts(raw: str) -> Dict[str, Any]:
+        # Parse the first JSON object after any preamble, ignoring trailing text
+        return _with_fact_defaults(parse_json_prefix(raw, "{"))
 
-        # 7) Ensure all required keys exist
-        for k, v in defaults.items():
-            fact_dict.setdefault(k, v)
 
-        return fact_dict
\ No newline at end of file
+class ExtractFactsBatchTool(ExtractFactsTool):
+    """
+    Batched variant of ExtractFactsTool: one generation for many scenes.
+    """
+
+    name        = "extract_facts_batch"
+    description = (
+        "Given a list of narrative paragraphs, extracts the same JSON facts as "
+        "extract_facts for each one, returned as a list in input order."
+    )
+
+    inputs = {
+        "scene_texts": {
+            "type": "array",
+            "description": "The narrative paragraphs from which to extract facts.",
+            "required": True
+        }
+    }
+    output_type = "array"
+
+    def forward(self, scene_texts: List[str]) -> List[Dict[str, Any]]:
+        return self.forward_batch(scene_texts)
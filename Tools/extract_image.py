@@ -1,16 +1,14 @@
 # Tools/scene_extractor_tool.py
 
-from typing import Dict
+from typing import List
 from smolagents import tool
-from llm_utils import tokenizer, generate_completion
-import torch
+from transformers import StoppingCriteriaList
+from llm_utils import WordCountStop, generate_batch
 
-@tool
-def extract_scene(context: str) -> str:
-    """
-    Identify the key visual scene in one vivid paragraph (≤77 tokens).
-    """
-    prompt = f"""
+MAX_WORDS = 77
+
+_SYSTEM_PROMPT = "Extract a single visual scene."
+_USER_PROMPT = """
 You are a visual scene extractor. Given the text below,
 produce one vivid paragraph (max 77 tokens) describing the key visual moment. Return only that paragraph.
 
@@ -21,26 +19,32 @@ Text:
 
 Visual description:"""
 
-    inputs = tokenizer.apply_chat_template(
-        [{"role":"system","content":"Extract a single visual scene."},
-         {"role":"user","content":prompt}],
-        tokenize=True,
-        add_generation_prompt=True,
-        return_tensors="pt",
-        return_dict=True
-    ).to(tokenizer.device)
-
-    with torch.no_grad():
-        outputs = generate_completion(inputs,
-                                      max_new_tokens=100,
-                                      temperature=0.0,
-                                      do_sample=False)
-
-    plen = inputs["input_ids"].shape[-1]
-    gen_ids = outputs[0][plen:]
-    raw     = tokenizer.decode(gen_ids, skip_special_tokens=True).strip()
-    # enforce token limit
-    words = raw.split()
-    if len(words) > 77:
-        raw = " ".join(words[:77])
-    return raw
+
+def extract_scene_batch(contexts: List[str]) -> List[str]:
+    """
+    Extracts the visual scene of several texts with a single batched generate() call.
+    """
+    raws = generate_batch(
+        _SYSTEM_PROMPT,
+        _USER_PROMPT,
+        [{"context": context} for context in contexts],
+        max_new_tokens=90,
+        # Stop as soon as a row starts word MAX_WORDS + 1 instead of decoding the full budget
+        stopping_criteria=StoppingCriteriaList([WordCountStop(MAX_WORDS)])
+    )
+    # enforce word limit; maxsplit keeps the split from building the full word list
+    return [" ".join(raw.split(maxsplit=MAX_WORDS)[:MAX_WORDS]) for raw in raws]
+
+
+@tool
+def extract_scene(context: str) -> str:
+    """
+    Identify the key visual scene in one vivid paragraph (≤77 tokens).
+
+    Args:
+        context (str): The story text to extract the visual moment from.
+
+    Returns:
+        str: One paragraph describing the key visual moment.
+    """
+    return extract_scene_batch([context])[0]
@@ -2,24 +2,11 @@
 
 from typing import Dict, Any, List
 from smolagents import tool
-from llm_utils import tokenizer, model, generate_completion
-import torch
-import json
+from llm_utils import generate_batch, parse_json_prefix
+import orjson
 
-@tool
-def generate_choices(scene_text: str, facts: Dict[str, Any]) -> List[str]:
-    """
-    Generate 2–4 next-step choices for the reader based on the scene and facts.
-
-    Args:
-        scene_text (str): The latest narrative paragraph.
-        facts (Dict[str,Any]): Structured facts (location, weather, npc_states, etc.)
-
-    Returns:
-        List[str]: A list of between 2 and 4 short choice strings.
-    """
-    facts_json = json.dumps(facts, indent=2)
-    prompt = f"""
+_SYSTEM_PROMPT = "You produce JSON arrays of story choices."
+_USER_PROMPT = """
 You are an interactive-story choice generator. Given the scene and known facts below,
 propose between 2 and 4 plausible next-step choices. Return *only* a JSON array of strings.
 
@@ -35,46 +22,55 @@ Requirements:
 - 2 to 4 concise, actionable choices (max one sentence each).
 - No extra commentary—just the JSON list.
 """
+_CHOICES_SCHEMA = {"type": "array", "minItems": 2, "maxItems": 4, "items": {"type": "string"}}
+
+
+def generate_choices_batch(scenes: List[str], facts_list: List[Dict[str, Any]]) -> List[List[str]]:
+    """
+    Generates the choices for several scenes with a single batched generate() call.
+    Returns one list of 2–4 choice strings per scene, in input order.
+    """
+    raws = generate_batch(
+        _SYSTEM_PROMPT,
+        _USER_PROMPT,
+        [
+            {"scene_text": scene_text, "facts_json": orjson.dumps(facts, option=orjson.OPT_SORT_KEYS).decode()}
+            for scene_text, facts in zip(scenes, facts_list)
+        ],
+        json_schema=_CHOICES_SCHEMA,
+        max_new_tokens=128
+    )
+    return [_parse_choices(raw) for raw in raws]
+
 
-    # wrap in a chat template
-    messages = [
-        {"role": "system", "content": "You produce JSON arrays of story choices."},
-        {"role": "user",   "content": prompt}
-    ]
-
-    # tokenize & move to device
-    inputs = tokenizer.apply_chat_template(
-        messages,
-        tokenize=True,
-        add_generation_prompt=True,
-        return_tensors="pt",
-        return_dict=True
-    ).to(model.device)
-
-    # generate
-    with torch.no_grad():
-        outputs = model.generate(inputs, max_new_tokens=128)
-
-    # slice off prompt
-    prompt_len = inputs["input_ids"].shape[-1]
-    gen_ids    = outputs[0][prompt_len:]
-
-    # decode, find JSON
-    raw = tokenizer.decode(gen_ids, skip_special_tokens=True)
-    start = raw.find("[")
-    candidate = raw[start:] if start >= 0 else raw
-
-    # parse JSON, fallback
-    try:
-        choices = json.loads(candidate)
-        if (
-            isinstance(choices, list)
-            and 2 <= len(choices) <= 4
-            and all(isinstance(c, str) for c in choices)
-        ):
-            return choices
-    except:
-        pass
+def _parse_choices(raw: str) -> List[str]:
+    # Parse the first JSON array after any preamble, ignoring trailing text
+    return _valid_choices(parse_json_prefix(raw, "["))
+
+
+def _valid_choices(choices: Any) -> List[str]:
+    # Parsed choices if they are 2–4 strings, otherwise the fallback pair
+    if (
+        isinstance(choices, list)
+        and 2 <= len(choices) <= 4
+        and all(isinstance(c, str) for c in choices)
+    ):
+        return choices
 
     # fallback
     return ["Continue forward", "Turn back"]
+
+
+@tool
+def generate_choices(scene_text: str, facts: Dict[str, Any]) -> List[str]:
+    """
+    Generate 2–4 next-step choices for the reader based on the scene and facts.
+
+    Args:
+        scene_text (str): The latest narrative paragraph.
+        facts (Dict[str,Any]): Structured facts (location, weather, npc_states, etc.)
+
+    Returns:
+        List[str]: A list of between 2 and 4 short choice strings.
+    """
+    return generate_choices_batch([scene_text], [facts])[0]
@@ -1,47 +1,106 @@
 import os
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
 import torch
 from PIL import Image
-from diffusers import StableDiffusionPipeline, EulerDiscreteScheduler
+from diffusers import StableDiffusionPipeline, DPMSolverMultistepScheduler
 import warnings
 from smolagents import tool
+from llm_utils import save_weights_atomically
 
 warnings.filterwarnings("ignore")
 
-# Global pipeline variable for reuse
+# Global pipeline for reuse; the lock keeps concurrent first calls from loading it twice
 _pipeline = None
+_PIPELINE_LOCK = threading.Lock()
+# One denoising run at a time: the scheduler keeps per-run state (timesteps, step
+# index, past model outputs) and the compiled UNet replays shared CUDA graphs, so
+# concurrent runs on the shared pipeline would corrupt each other. Concurrent
+# callers therefore wait for each other here instead of running in parallel
+_DIFFUSION_LOCK = threading.Lock()
+NUM_INFERENCE_STEPS = 10
+
+# Recently generated images by seed and prompt, so a repeated seeded prompt skips diffusion
+_IMAGE_CACHE: "OrderedDict[bytes, Image.Image]" = OrderedDict()
+_IMAGE_CACHE_MAX = 16
+_IMAGE_CACHE_LOCK = threading.Lock()
 
 def get_pipeline():
     """Initialize and return the Stable Diffusion pipeline."""
     global _pipeline
-    if _pipeline is None:
-        try:
-            device = "cuda" if torch.cuda.is_available() else "cpu"
-            dtype = torch.float16 if torch.cuda.is_available() else torch.float32
-            
-            _pipeline = StableDiffusionPipeline.from_pretrained(
+    with _PIPELINE_LOCK:
+        if _pipeline is None:
+            _pipeline = _load_pipeline()
+    return _pipeline
+
+def _load_pipeline():
+    """Load and set up the Stable Diffusion pipeline, or "mock" when loading fails."""
+    try:
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        dtype = torch.float16 if torch.cuda.is_available() else torch.float32
+        
+        # Reuse converted weights from STORY_WEIGHT_CACHE when present
+        cache_root = os.environ.get("STORY_WEIGHT_CACHE")
+        cache_dir = os.path.join(cache_root, f"stable-diffusion-v1-5-{str(dtype).split('.')[-1]}") if cache_root else None
+        if cache_dir and os.path.isdir(cache_dir):
+            pipe = StableDiffusionPipeline.from_pretrained(
+                cache_dir,
+                torch_dtype=dtype,
+                safety_checker=None,
+                requires_safety_checker=False,
+                local_files_only=True
+            )
+        else:
+            pipe = StableDiffusionPipeline.from_pretrained(
                 "runwayml/stable-diffusion-v1-5",
                 torch_dtype=dtype,
                 safety_checker=None,
                 requires_safety_checker=False
-            ).to(device)
+            )
+            if cache_dir:
+                save_weights_atomically(cache_dir, lambda d: pipe.save_pretrained(d, safe_serialization=True))
+        pipe = pipe.to(device)
+        
+        # Multistep DPM-Solver reaches the same quality in about half the steps
+        pipe.scheduler = DPMSolverMultistepScheduler.from_config(pipe.scheduler.config)
+        
+        if device == "cuda":
+            # channels_last matches the NHWC conv kernels cuDNN prefers on Volta and newer
+            if torch.cuda.get_device_capability()[0] >= 7:
+                pipe.unet.to(memory_format=torch.channels_last)
+                pipe.vae.to(memory_format=torch.channels_last)
+            # Memory-efficient attention when xFormers is installed; otherwise the
+            # default attention processor already uses PyTorch SDPA
+            try:
+                pipe.enable_xformers_memory_efficient_attention()
+            except Exception:
+                pass
+            # The compiled UNet fuses its kernels; the warm-up call below pays the
+            # compile cost up front
+            pipe.unet = torch.compile(pipe.unet, mode="reduce-overhead")
+            with _DIFFUSION_LOCK:
+                pipe("warm-up", num_inference_steps=NUM_INFERENCE_STEPS, height=512, width=512)
+        elif hasattr(pipe, 'enable_attention_slicing'):
+            # Slicing trades speed for memory; only worth it off-GPU
+            pipe.enable_attention_slicing()
             
-            if hasattr(_pipeline, 'enable_attention_slicing'):
-                _pipeline.enable_attention_slicing()
-                
-        except Exception as e:
-            print(f"Failed to load pipeline: {e}")
-            _pipeline = "mock"
-    
-    return _pipeline
+    except Exception as e:
+        print(f"Failed to load pipeline: {e}")
+        pipe = "mock"
+    return pipe
 
 @tool
-def generate_image(scene_prompt: str) -> Image.Image:
+def generate_image(scene_prompt: str, seed: Optional[int] = None) -> Image.Image:
     """
     Generates a cartoon-style image from a scene prompt using Stable Diffusion v1.5.
-    Falls back to a placeholder if loading fails.
+    Falls back to a plain placeholder if loading fails; the placeholder is marked
+    with image.info["placeholder"] = True so callers can avoid persisting it.
     
     Args:
         scene_prompt (str): Description of the scene to generate
+        seed (Optional[int]): Seed for a reproducible image; a fresh random seed when omitted
         
     Returns:
         PIL.Image.Image: Generated cartoon-style image
@@ -50,24 +109,45 @@ def generate_image(scene_prompt: str) -> Image.Image:
     
     # Fallback to placeholder if pipeline loading failed
     if pipe == "mock":
-        return Image.new('RGB', (512, 512), color='lightblue')
+        placeholder = Image.new('RGB', (512, 512), color='lightblue')
+        placeholder.info["placeholder"] = True
+        return placeholder
+    
+    # Serve repeated seeded prompts from the cache; unseeded calls always draw a new image
+    key = hashlib.blake2b(f"{seed}\0{scene_prompt}".encode(), digest_size=16).digest() if seed is not None else None
+    if key is not None:
+        with _IMAGE_CACHE_LOCK:
+            if key in _IMAGE_CACHE:
+                _IMAGE_CACHE.move_to_end(key)
+                return _IMAGE_CACHE[key]
     
     # Enhance prompt for cartoon style
     prompt = f"cartoon style, {scene_prompt}, colorful, animated"
     
-    # Generate image with fixed seed for reproducibility
-    gen = torch.Generator(device=pipe.device).manual_seed(42)
+    # One generator per call, so concurrent callers never reseed each other's RNG
+    generator = torch.Generator(device=pipe.device)
+    if seed is not None:
+        generator.manual_seed(seed)
+    else:
+        generator.seed()
     
-    result = pipe(
-        prompt,
-        guidance_scale=7.5,
-        num_inference_steps=20,
-        height=512,
-        width=512,
-        generator=gen
-    )
+    with _DIFFUSION_LOCK:
+        result = pipe(
+            prompt,
+            guidance_scale=7.5,
+            num_inference_steps=NUM_INFERENCE_STEPS,
+            height=512,
+            width=512,
+            generator=generator
+        )
     
-    return result.images[0]
+    image = result.images[0]
+    if key is not None:
+        with _IMAGE_CACHE_LOCK:
+            _IMAGE_CACHE[key] = image
+            if len(_IMAGE_CACHE) > _IMAGE_CACHE_MAX:
+                _IMAGE_CACHE.popitem(last=False)
+    return image
 
 if __name__ == "__main__":
     # Test the function
@@ -1,10 +1,61 @@
-import torch
-# from transformers import AutoTokenizer, AutoModelForCausalLM
-from llm_utils import tokenizer, model, generate_completion
+import functools
+import hashlib
+import os
+from collections import OrderedDict
+from typing import List, Tuple
+from sentence_transformers import SentenceTransformer
 from smolagents import tool
 import warnings
 warnings.filterwarnings("ignore")
 
+EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+# Cosine similarity below which two contexts count as a major change
+CHANGE_THRESHOLD = float(os.getenv("CHANGE_THRESHOLD", "0.6"))
+
+# Content-addressed cache of past decisions, so retried scenes skip the embedder
+_CHANGE_CACHE: "OrderedDict[bytes, int]" = OrderedDict()
+_CHANGE_CACHE_MAX = 1024
+
+
+@functools.lru_cache(maxsize=1)
+def _get_embedder() -> SentenceTransformer:
+    # ~22M parameters: cheap enough for CPU, loaded on first use
+    return SentenceTransformer(EMBED_MODEL)
+
+
+def check_significant_change_batch(pairs: List[Tuple[str, str]]) -> List[int]:
+    """
+    Runs the change check for several (previous, current) context pairs with a
+    single embedding pass over the pairs not seen before; returns one 0/1 flag per pair.
+    """
+    keys = [hashlib.blake2b(f"{prev}\0{curr}".encode(), digest_size=16).digest() for prev, curr in pairs]
+    flags = [_CHANGE_CACHE.get(key) for key in keys]
+    misses = [i for i, flag in enumerate(flags) if flag is None]
+
+    # Embed only the pairs not decided before
+    if misses:
+        prev_texts = [pairs[i][0] for i in misses]
+        curr_texts = [pairs[i][1] for i in misses]
+        emb = _get_embedder().encode(
+            prev_texts + curr_texts,
+            batch_size=32,
+            convert_to_tensor=True,
+            normalize_embeddings=True
+        )
+        # Normalized embeddings: the row-wise dot product is the cosine similarity
+        sims = (emb[:len(misses)] * emb[len(misses):]).sum(dim=-1)
+        for i, sim in zip(misses, sims.tolist()):
+            flags[i] = int(sim < CHANGE_THRESHOLD)
+
+    # Remember every decision, evicting the least recently used ones
+    for key, flag in zip(keys, flags):
+        _CHANGE_CACHE[key] = flag
+        _CHANGE_CACHE.move_to_end(key)
+    while len(_CHANGE_CACHE) > _CHANGE_CACHE_MAX:
+        _CHANGE_CACHE.popitem(last=False)
+    return flags
+
+
 @tool
 def check_significant_change(previous_context: str, current_context: str) -> int:
     """
@@ -17,52 +68,7 @@ def check_significant_change(previous_context: str, current_context: str) -> int
     Returns:
         int: 1 if major significant change detected, 0 otherwise
     """
-    prompt = f"""
-Compare these two contexts and determine if there is a major significant change (like a new scene, environment, or dramatic shift in situation). Reply with only "change" for a major significant change, or "unchange" if the contexts are similar or show minor differences.
-
-Previous: {previous_context}
-Current: {current_context}
-
-Answer (change or unchange):"""
-
-    # wrap in a chat template
-    messages = [
-        {"role": "system", "content": "You detect significant changes between contexts. Reply only with 'change' or 'unchange'."},
-        {"role": "user", "content": prompt}
-    ]
-
-    # tokenize & move to device
-    inputs = tokenizer.apply_chat_template(
-        messages,
-        tokenize=True,
-        add_generation_prompt=True,
-        return_tensors="pt",
-        return_dict=True
-    ).to(model.device)
-
-    # generate
-    with torch.no_grad():
-        outputs = generate_completion(
-            **inputs,
-            max_new_tokens=10,
-            temperature=0.0,
-            do_sample=False,
-            pad_token_id=tokenizer.eos_token_id
-        )
-
-    # slice off prompt
-    prompt_len = inputs["input_ids"].shape[-1]
-    gen_ids = outputs[0][prompt_len:]
-
-    # decode response
-    raw = tokenizer.decode(gen_ids, skip_special_tokens=True)
-    response = raw.strip().lower()
-
-    # check for change indicators
-    if "change" in response and "unchange" not in response:
-        return 1
-    else:
-        return 0
+    return check_significant_change_batch([(previous_context, current_context)])[0]
 
 if __name__ == "__main__":
     # --- Test Cases ---
@@ -74,4 +80,7 @@ if __name__ == "__main__":
     
     for i, (prev, curr) in enumerate(tests, 1):
         result = check_significant_change(previous_context=prev, current_context=curr)
-        print(f"Test {i}: Prev='{prev}' | Curr='{curr}' -> Change Detected: {result}")
\ No newline at end of file
+        print(f"Test {i}: Prev='{prev}' | Curr='{curr}' -> Change Detected: {result}")
+
+    # Test batched check
+    print(f"Batch Result: {check_significant_change_batch(tests)}")
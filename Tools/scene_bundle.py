@@ -0,0 +1,105 @@
+# Tools/scene_bundle.py
+
+from typing import Dict, Any, List
+from smolagents import Tool
+from llm_utils import generate_batch, parse_json_prefix
+from Tools.build_world import _with_world_defaults
+from Tools._build_world_backends import WORLD_SCHEMA
+from Tools.extract_facts import _FACTS_SCHEMA, _with_fact_defaults
+from Tools.generate_choices import _CHOICES_SCHEMA, _valid_choices
+import orjson
+
+_SYSTEM_PROMPT = "You extract JSON facts, story choices and world-building details."
+_USER_PROMPT = """
+You are a multi-task story assistant. Read the scene and the facts known before it,
+then output one valid JSON object with exactly three keys:
+
+facts: the facts of the scene, with the keys
+  1) location: e.g. "rainy_forest" or null
+  2) weather: e.g. "rainy" or null
+  3) time_of_day: e.g. "evening" or null
+  4) main_character: protagonist name or null
+  5) npc_states: dict of other characters → {status, location}, or {}
+  6) inventory_items: list of item names, or []
+  7) events: 1–2 sentence summary of what happened
+choices: a JSON array of 2 to 4 concise, actionable next-step choices (max one sentence each).
+world: the world around the scene, with the keys
+  1) setting_description: a 2–3 sentence vivid paragraph describing the environment.
+  2) flora: a list of 3–5 plant species commonly found here.
+  3) fauna: a list of 3–5 animals or creatures one might encounter.
+  4) ambiance: a list of 3–5 sensory details (sounds, smells, tactile feelings).
+
+Scene:
+\"\"\"
+{scene_text}
+\"\"\"
+
+Known facts:
+{facts_json}
+
+No extra commentary—just the JSON object.
+"""
+_SCHEMA = {
+    "type": "object",
+    "properties": {"facts": _FACTS_SCHEMA, "choices": _CHOICES_SCHEMA, "world": WORLD_SCHEMA},
+    "required": ["facts", "choices", "world"]
+}
+
+
+class SceneBundleTool(Tool):
+    """
+    ExtractFactsTool, generate_choices and build_world fused into one
+    generation, so the scene is prefilled once for all three.
+    """
+
+    name        = "scene_bundle"
+    description = (
+        "Given a narrative paragraph and the facts known before it, returns JSON with "
+        "keys facts (as extract_facts), choices (2–4 next-step options) and world "
+        "(as build_world)."
+    )
+
+    inputs = {
+        "scene_text": {
+            "type": "string",
+            "description": "The narrative paragraph from which to extract facts.",
+            "required": True
+        },
+        "facts": {
+            "type": "object",
+            "description": "Structured facts known before this scene.",
+            "required": True
+        }
+    }
+    output_type = "object"
+
+    def forward(self, scene_text: str, facts: Dict[str, Any]) -> Dict[str, Any]:
+        return self.forward_batch([scene_text], [facts])[0]
+
+    def forward_batch(self, scene_texts: List[str], facts_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Builds the bundle for several scenes with a single batched generate() call.
+        """
+        raws = generate_batch(
+            _SYSTEM_PROMPT,
+            _USER_PROMPT,
+            [
+                {"scene_text": text, "facts_json": orjson.dumps(facts, option=orjson.OPT_SORT_KEYS).decode()}
+                for text, facts in zip(scene_texts, facts_list)
+            ],
+            json_schema=_SCHEMA,
+            max_new_tokens=640
+        )
+        return [self._parse(raw) for raw in raws]
+
+    @staticmethod
+    def _parse(raw: str) -> Dict[str, Any]:
+        # Each part falls back on its own tool's defaults when missing or malformed
+        parsed = parse_json_prefix(raw, "{")
+        if not isinstance(parsed, dict):
+            parsed = {}
+        return {
+            "facts": _with_fact_defaults(parsed.get("facts")),
+            "choices": _valid_choices(parsed.get("choices")),
+            "world": _with_world_defaults(parsed.get("world"))
+        }
@@ -1,21 +1,93 @@
 # story_generator.py
 
-from typing import Optional
+from typing import Any, AsyncIterator, Dict, Iterator, Optional
+import asyncio
+import functools
+import hashlib
 import os
+import threading
 
 from smolagents import Tool
-from huggingface_hub import InferenceClient
-
-from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline
-import torch
-torch.manual_seed(30)
+from huggingface_hub import AsyncInferenceClient, InferenceClient
 
 
 HF_TOKEN   = os.getenv("HUGGINGFACE_API_TOKEN", "")
 MODEL_NAME = "deepseek-ai/DeepSeek-V3-0324"
+# OpenAI-compatible server to use instead of the HF Inference API, e.g. a local
+# `vllm serve deepseek-ai/DeepSeek-V3-0324 --enable-prefix-caching` at
+# http://localhost:8000/v1, which batches concurrent story requests
+STORY_LLM_URL = os.getenv("STORY_LLM_URL")
+
+# Decode budget per scene; the system prompt asks for a length that ends well inside it
+MAX_TOKENS = 250
+
+SYSTEM_PROMPT = (
+    "You are a children's-book style storyteller. Write each scene in about 150 words.\n"
+    "The user message starts with a mode tag:\n"
+    "[MODE=opening]: generate a vivid opening scene from the user's seed prompt.\n"
+    "[MODE=continue_from_choice]: continue the story from the reader's last choice.\n"
+    "[MODE=continue_from_context]: continue the story based on the context alone."
+)
+
+# The system prompt is byte-identical on every call, so a self-hosted server with
+# prefix caching (vLLM --enable-prefix-caching, TGI) prefills it once and reuses its
+# KV cache afterwards. Its hash is also sent as a header, so a load balancer in
+# front of several replicas can route every request to the one that holds it.
+ENABLE_KV_CACHE_REUSE = os.getenv("STORY_KV_CACHE_REUSE", "1") != "0"
+PROMPT_PREFIX_HASH = hashlib.sha256(SYSTEM_PROMPT.encode()).hexdigest()
+
+# Upper bound on story requests in flight through the async client
+MAX_CONCURRENT_REQUESTS = 8
+# Seconds before a stalled request fails instead of holding its worker
+REQUEST_TIMEOUT = 60
+
+
+# Guards the sync client factory: tools are called from several worker threads,
+# which would otherwise race to build (and leak) their own connection pools
+_CLIENT_LOCK = threading.Lock()
+
+
+def _check_credentials() -> None:
+    # Checked when the first client is built, so importing the tool never needs a token
+    if not HF_TOKEN and not STORY_LLM_URL:
+        raise RuntimeError("Please set HUGGINGFACE_API_TOKEN (or STORY_LLM_URL) in your environment.")
+
+
+def _client_kwargs() -> Dict[str, Any]:
+    if not STORY_LLM_URL:
+        return {"token": HF_TOKEN, "timeout": REQUEST_TIMEOUT}
+    kwargs = {"base_url": STORY_LLM_URL, "api_key": HF_TOKEN or "-", "timeout": REQUEST_TIMEOUT}
+    if ENABLE_KV_CACHE_REUSE:
+        kwargs["headers"] = {"X-Prompt-Prefix-Hash": PROMPT_PREFIX_HASH}
+    return kwargs
+
+
+@functools.lru_cache(maxsize=1)
+def _new_client() -> InferenceClient:
+    _check_credentials()
+    return InferenceClient(**_client_kwargs())
+
+
+def _get_client() -> InferenceClient:
+    """
+    Returns the process-wide InferenceClient, so the HTTP session is reused across scenes.
+    """
+    with _CLIENT_LOCK:
+        return _new_client()
+
+
+@functools.lru_cache(maxsize=1)
+def _get_async_client() -> AsyncInferenceClient:
+    # Only called from the shared async_utils loop, whose single thread cannot race itself
+    _check_credentials()
+    return AsyncInferenceClient(**_client_kwargs())
+
+
+@functools.lru_cache(maxsize=1)
+def _get_async_limit() -> asyncio.Semaphore:
+    # Created on the shared async_utils loop, which the semaphore binds to
+    return asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
 
-if not HF_TOKEN:
-    raise RuntimeError("Please set HUGGINGFACE_API_TOKEN in your environment.")
 
 class StoryGeneratorTool(Tool):
     name        = "story_generator"
@@ -42,82 +114,99 @@ class StoryGeneratorTool(Tool):
     }
 
     output_type = "string"
-    _client: Optional[InferenceClient] = None
-
-    def _get_client(self) -> InferenceClient:
-        if self._client is None:
-            self._client = InferenceClient(token=HF_TOKEN)
-        return self._client
+    # Exposed on the class so a fake client can be swapped in per tool
+    _get_client = staticmethod(_get_client)
 
-    def forward(
-        self,
+    @staticmethod
+    def _build_messages(
         context: str,
         initial_prompt: Optional[str] = None,
         last_choice:  Optional[str] = None,
-    ) -> str:
+    ) -> list:
         if initial_prompt and last_choice:
             raise ValueError("Provide exactly one of `initial_prompt` or `last_choice`.")
 
-        # Build prompt
+        # Only the user message varies, so the system prompt stays a cacheable prefix
         if initial_prompt:
-            system_content = (
-                "You are a children's-book style storyteller. Generate a vivid opening scene."
+            user_content = (
+                "[MODE=opening]\n"
+                f"User seed prompt:\n\"{initial_prompt}\"\n\nGenerate the opening scene."
             )
-            user_content = f"User seed prompt:\n\"{initial_prompt}\"\n\nGenerate the opening scene."
 
         elif last_choice:
-            system_content = (
-                "You are a children's-book style storyteller. Continue from the last choice."
-            )
             user_content = (
+                "[MODE=continue_from_choice]\n"
                 f"Context:\n{context}\n\n"
                 f"Last choice: \"{last_choice}\"\n\nGenerate the next scene."
             )
 
         else:
-            system_content = (
-                "You are a children's-book style storyteller. Continue based on context alone."
+            user_content = (
+                "[MODE=continue_from_context]\n"
+                f"Context:\n{context}\n\nGenerate the next scene."
             )
-            user_content = f"Context:\n{context}\n\nGenerate the next scene."
 
-        messages = [
-            {"role": "system", "content": system_content},
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user",   "content": user_content},
         ]
 
-        # 1) Tokenize/conform the messages
-        tokenizer = AutoTokenizer.from_pretrained("deepseek-ai/DeepSeek-V3-0324")
-        model     = AutoModelForCausalLM.from_pretrained(
-            "deepseek-ai/DeepSeek-V3-0324", device_map="auto", torch_dtype=torch.bfloat16
-        )
-
-        inputs = tokenizer.apply_chat_template(
-            messages,
-            tokenize=True,
-            add_generation_prompt=True,
-            return_tensors="pt"
-        ).to(model.device)
-
-        # 2) Generate
-        outputs = model.generate(**inputs, max_new_tokens=400)
-
-        # 3) Extract only the generated portion (not the prompt)
-        input_length = inputs["input_ids"].shape[-1]
-        generated_ids = outputs[0][input_length:]
-
-        # 4) Decode and return
-        scene_text = tokenizer.decode(generated_ids, skip_special_tokens=True)
-        
-        return scene_text
-
-        # client = self._get_client()
-        # # Non‐streaming chat call
-        # resp = client.chat_completion(
-        #     model=MODEL_NAME,
-        #     messages=messages,
-        #     temperature=0.7,
-        #     max_tokens=400,
-        #     stream=False
-        # )
-
-        # return 
+    def stream(
+        self,
+        context: str,
+        initial_prompt: Optional[str] = None,
+        last_choice:  Optional[str] = None,
+    ) -> Iterator[str]:
+        """
+        Yields the next scene as text chunks while the model is still generating.
+        """
+        messages = self._build_messages(context, initial_prompt, last_choice)
+        for chunk in self._get_client().chat_completion(
+            model=MODEL_NAME,
+            messages=messages,
+            temperature=0.7,
+            max_tokens=MAX_TOKENS,
+            stream=True
+        ):
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+
+    def forward(
+        self,
+        context: str,
+        initial_prompt: Optional[str] = None,
+        last_choice:  Optional[str] = None,
+    ) -> str:
+        return "".join(self.stream(context, initial_prompt, last_choice))
+
+    async def astream(
+        self,
+        context: str,
+        initial_prompt: Optional[str] = None,
+        last_choice:  Optional[str] = None,
+    ) -> AsyncIterator[str]:
+        """
+        stream() without blocking the event loop, so several scenes can be
+        generated concurrently (at most MAX_CONCURRENT_REQUESTS at a time).
+        """
+        messages = self._build_messages(context, initial_prompt, last_choice)
+        async with _get_async_limit():
+            async for chunk in await _get_async_client().chat_completion(
+                model=MODEL_NAME,
+                messages=messages,
+                temperature=0.7,
+                max_tokens=MAX_TOKENS,
+                stream=True
+            ):
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+
+    async def aforward(
+        self,
+        context: str,
+        initial_prompt: Optional[str] = None,
+        last_choice:  Optional[str] = None,
+    ) -> str:
+        return "".join([delta async for delta in self.astream(context, initial_prompt, last_choice)])
@@ -1,13 +1,19 @@
 # main.py
 
 import os
+import asyncio
 from typing import Any, Dict, List, Optional
 
 import uvicorn
+import orjson
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
 
+from async_utils import run_async_safely
+from llm_utils import tail_tokens
 from store_facts import StoryState
+from Tools.story_generator import MODEL_NAME as STORY_MODEL, StoryGeneratorTool
 from agents import (
     get_story_agent,
     get_fact_agent,
@@ -16,7 +22,11 @@ from agents import (
     get_world_agent,
 )
 
-app = FastAPI(title="Interactive Storyteller API")
+# orjson serializes the (growing) StoryState payloads in every response
+app = FastAPI(title="Interactive Storyteller API", default_response_class=ORJSONResponse)
+
+# Prompt budget for the scene context; longer contexts keep only their most recent tokens
+CONTEXT_MAX_TOKENS = 1024
 
 # ---------------------------
 # Pydantic Models for Requests
@@ -70,7 +80,7 @@ def generate_scene_endpoint(req: GenerateSceneRequest):
         raise HTTPException(status_code=400, detail=f"Invalid state payload: {e}")
 
     # 2) Build context string (last N scenes + facts). Use N=3 for example.
-    context_str = state_obj.get_context_window(n=3)
+    context_str = tail_tokens(state_obj.get_context_window(n=3), CONTEXT_MAX_TOKENS, STORY_MODEL)
 
     # 3) Call the Story Generator agent (LLM) to get a new scene
     story_agent = get_story_agent()
@@ -83,6 +93,49 @@ def generate_scene_endpoint(req: GenerateSceneRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Story generation failed: {e}")
 
+    return _finish_scene(state_obj, scene_text)
+
+
+@app.post("/generate_scene/stream")
+def generate_scene_stream_endpoint(req: GenerateSceneRequest):
+    """
+    Streaming variant of /generate_scene. The response is newline-delimited JSON:
+    {"delta": "..."} lines while the scene is generated, then one {"result": {...}}
+    line with the same payload /generate_scene returns (or {"error": "..."}).
+    """
+    try:
+        state_obj = StoryState.from_dict(req.state)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid state payload: {e}")
+    context_str = tail_tokens(state_obj.get_context_window(n=3), CONTEXT_MAX_TOKENS, STORY_MODEL)
+
+    def _events():
+        # The story tool streams directly; the rest runs once the text is complete
+        try:
+            parts = []
+            for delta in StoryGeneratorTool().stream(
+                context=context_str,
+                initial_prompt=req.initial_prompt,
+                last_choice=req.last_choice
+            ):
+                parts.append(delta)
+                yield orjson.dumps({"delta": delta}) + b"\n"
+            result = _finish_scene(state_obj, "".join(parts))
+        except HTTPException as e:
+            yield orjson.dumps({"error": e.detail}) + b"\n"
+            return
+        except Exception as e:
+            yield orjson.dumps({"error": f"Story generation failed: {e}"}) + b"\n"
+            return
+        yield orjson.dumps({"result": result.model_dump()}) + b"\n"
+
+    return StreamingResponse(_events(), media_type="application/x-ndjson")
+
+
+def _finish_scene(state_obj: StoryState, scene_text: str) -> GenerateSceneResponse:
+    """
+    Steps 4-10 of /generate_scene: everything that runs once the scene text is complete.
+    """
     # 4) Call the Fact Extraction agent on the new scene_text
     fact_agent = get_fact_agent()
     try:
@@ -115,22 +168,22 @@ def generate_scene_endpoint(req: GenerateSceneRequest):
     state_obj.update_facts(new_facts)
     state_obj.append_scene(scene_text)
 
-    # 8) Generate next‐step choices
+    # 8) Generate next‐step choices and (9) build world description/details
+    #    concurrently; both only read the merged facts
     choices_agent = get_choices_agent()
-    try:
-        choices = choices_agent.run(
-            scene_text=scene_text,
-            facts=state_obj.facts
-        )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Choice generation failed: {e}")
-
-    # 9) Build world description/details
     world_agent = get_world_agent()
-    try:
-        world = world_agent.run(facts=state_obj.facts)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"World‐building failed: {e}")
+
+    async def _choices_and_world():
+        return await asyncio.gather(
+            asyncio.to_thread(choices_agent.run, scene_text=scene_text, facts=state_obj.facts),
+            asyncio.to_thread(world_agent.run, facts=state_obj.facts),
+            return_exceptions=True
+        )
+    choices, world = run_async_safely(_choices_and_world())
+    if isinstance(choices, Exception):
+        raise HTTPException(status_code=500, detail=f"Choice generation failed: {choices}")
+    if isinstance(world, Exception):
+        raise HTTPException(status_code=500, detail=f"World‐building failed: {world}")
 
     # 10) Return everything, including the updated StoryState
     return GenerateSceneResponse(
@@ -0,0 +1,31 @@
+# async_utils.py
+
+import asyncio
+import concurrent.futures
+import threading
+from typing import Any, Coroutine, TypeVar
+
+T = TypeVar("T")
+
+# One event loop for the whole process, owned by a daemon thread and started once
+_LOOP = asyncio.new_event_loop()
+threading.Thread(target=_LOOP.run_forever, name="async-utils-loop", daemon=True).start()
+
+
+def run_async_safely(coro: Coroutine[Any, Any, T]) -> T:
+    """
+    Run `coro` on the shared background loop and block until it finishes.
+
+    Works from plain sync code, worker threads and from inside a running loop
+    (FastAPI / Gradio handlers), because the caller's own loop is never
+    re-entered. Do not call it from a coroutine already running on `_LOOP`.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _LOOP).result()
+
+
+def submit_async(coro: Coroutine[Any, Any, T]) -> "concurrent.futures.Future[T]":
+    """
+    Schedule `coro` on the shared background loop without waiting for it; the
+    returned Future can be awaited later with .result() or cancelled.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _LOOP)
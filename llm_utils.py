@@ -1,20 +1,672 @@
 # llm_utils.py
 
-from transformers import AutoTokenizer, AutoModelForCausalLM
+import os
+# Let the CUDA caching allocator grow/reuse segments across request sizes (read at first CUDA use)
+os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True")
+# Let the Rust tokenizer encode batches on all cores (it otherwise disables itself after a fork)
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "true")
+
+from typing import Callable, Dict, List, Tuple
+from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig, DynamicCache, PreTrainedModel, PreTrainedTokenizerBase, StaticCache, StoppingCriteria, StoppingCriteriaList
+import concurrent.futures
+import copy
+import functools
+import hashlib
+import importlib.util
+import itertools
+import json
+import orjson
+import re
+import shutil
+import threading
+import time
 import torch
+from collections import OrderedDict
 
 MODEL_NAME = "mistralai/Mistral-7B-Instruct-v0.3"
+STATIC_CACHE_LEN = 1536  # prompt + new tokens that fit the pre-allocated KV cache
+# "vllm" serves generate_batch() from a vLLM engine (paged KV cache, continuous
+# batching); needs the optional `vllm` package. Anything else uses transformers.
+LLM_BACKEND = os.getenv("STORY_LLM_BACKEND", "transformers")
+# Share of GPU memory the vLLM engine reserves for weights and KV cache; the rest
+# stays free for the diffusion and voice models on the same device
+VLLM_GPU_MEMORY = float(os.getenv("STORY_VLLM_GPU_MEMORY", "0.5"))
+# Weight format of the shared chat model: "nf4" (default), "int8" or "bf16"
+STORY_QUANT = os.getenv("STORY_QUANT", "nf4")
+# Directory for converted/quantized weights; when set, the first load saves them
+# there and later cold starts load them directly instead of converting again
+STORY_WEIGHT_CACHE = os.getenv("STORY_WEIGHT_CACHE")
+# Compile the model's forward with torch.compile on CUDA ("0" turns it off)
+STORY_COMPILE = os.getenv("STORY_COMPILE", "1") != "0"
+# Single-row generate_batch() calls for the same prompt template that arrive from
+# different threads within this many ms run as one batch ("0" turns it off). The
+# wait only applies while another generation is in flight; otherwise a call runs at once
+STORY_BATCH_WAIT_MS = float(os.getenv("STORY_BATCH_WAIT_MS", "5"))
+
+# Inference only: fp32 matmuls may use TF32 tensor cores (Ampere and newer)
+torch.set_float32_matmul_precision("high")
+
+# Serializes users of the shared static KV cache
+_STATIC_CACHE_LOCK = threading.Lock()
+
+# Single-row generate_batch() calls waiting to be run together, by template and kwargs
+_PENDING_ROWS: Dict[bytes, List[Tuple[Dict[str, str], concurrent.futures.Future]]] = {}
+_PENDING_LOCK = threading.Lock()
+# Generations currently running on the local model (guarded by _PENDING_LOCK)
+_IN_FLIGHT = 0
+
+# generate_batch() completions by prompt row and settings, least recently used first
+_COMPLETION_CACHE: "OrderedDict[bytes, str]" = OrderedDict()
+_COMPLETION_CACHE_MAX = 512
+_COMPLETION_LOCK = threading.Lock()
+
+# torch.cuda.empty_cache() synchronizes the device and can stall for hundreds of ms,
+# so tools never call it directly; they call release_cuda_cache() after each
+# generation, which only empties the cache every _EMPTY_EVERY calls.
+_N_CALLS = itertools.count(1)  # next() is atomic, so worker threads never lose a count
+_EMPTY_EVERY = 32
+
+
+def _quantization_config(quant: str):
+    """
+    bitsandbytes config for STORY_QUANT, or None for plain bf16 weights.
+    bitsandbytes needs CUDA, so CPU-only hosts always load bf16.
+    """
+    if not torch.cuda.is_available() or quant == "bf16":
+        return None
+    if quant == "int8":
+        # ~7.5 GB instead of ~14 GB
+        return BitsAndBytesConfig(load_in_8bit=True)
+    if quant == "nf4":
+        # ~4 GB instead of ~14 GB
+        return BitsAndBytesConfig(
+            load_in_4bit=True,
+            bnb_4bit_quant_type="nf4",
+            bnb_4bit_compute_dtype=torch.bfloat16,
+            bnb_4bit_use_double_quant=True
+        )
+    raise ValueError(f"STORY_QUANT must be one of nf4, int8, bf16; got {quant!r}.")
+
+
+def _attn_implementation() -> str:
+    """
+    FlashAttention-2 when the optional `flash-attn` package is installed and a GPU
+    is present, otherwise PyTorch's fused scaled_dot_product_attention.
+    """
+    if torch.cuda.is_available() and importlib.util.find_spec("flash_attn") is not None:
+        return "flash_attention_2"
+    torch.backends.cuda.enable_flash_sdp(True)
+    return "sdpa"
+
+
+def _weight_cache_dir():
+    """Where the converted weights for MODEL_NAME/STORY_QUANT live, or None when caching is off."""
+    if not STORY_WEIGHT_CACHE:
+        return None
+    quant = STORY_QUANT if torch.cuda.is_available() else "bf16"
+    return os.path.join(STORY_WEIGHT_CACHE, f"{MODEL_NAME.replace('/', '--')}-{quant}")
+
+
+def save_weights_atomically(path: str, save: Callable[[str], None]) -> None:
+    """
+    Runs `save(directory)` into a temporary sibling of `path` and renames it into
+    place once complete, so a cache directory that exists is always whole: a crash
+    mid-save leaves no `path`, and when two cold starts race the first rename wins.
+    """
+    tmp = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    try:
+        save(tmp)
+        try:
+            os.replace(tmp, path)
+        except OSError:
+            # Another process finished first; its copy is just as good
+            if not os.path.isdir(path):
+                raise
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+# Load **once**, on first use, and share across every tool
+@functools.lru_cache(maxsize=1)
+def get_llm() -> Tuple[PreTrainedTokenizerBase, PreTrainedModel]:
+    """
+    Returns the process-wide (tokenizer, model) pair, loading it on the first call.
+    """
+    # Reload the already converted/quantized weights when a local copy exists
+    cache_dir = _weight_cache_dir()
+    if cache_dir and os.path.isdir(cache_dir):
+        tokenizer = AutoTokenizer.from_pretrained(cache_dir, use_fast=True)
+        model     = AutoModelForCausalLM.from_pretrained(
+            cache_dir,
+            device_map="auto",
+            torch_dtype="auto",
+            low_cpu_mem_usage=True,
+            attn_implementation=_attn_implementation()
+        )
+    else:
+        tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME, use_fast=True)
+        quantization_config = _quantization_config(STORY_QUANT)
+        # "auto" keeps the checkpoint's bf16 instead of materializing fp32 first; safetensors
+        # shards are memory-mapped and placed straight onto their devices
+        model     = AutoModelForCausalLM.from_pretrained(
+            MODEL_NAME,
+            device_map="auto",
+            torch_dtype="auto",
+            low_cpu_mem_usage=True,
+            use_safetensors=True,
+            attn_implementation=_attn_implementation(),
+            quantization_config=quantization_config
+        )
+        if cache_dir:
+            # The bitsandbytes quant state is saved with the weights and restored from config.json
+            def _save(directory: str) -> None:
+                model.save_pretrained(directory, safe_serialization=True)
+                tokenizer.save_pretrained(directory)
+            save_weights_atomically(cache_dir, _save)
+    model.eval()
+
+    # Every tool decodes deterministically: make the greedy, KV-cached path the
+    # default so no generate() call can fall back to sampling or beam search
+    tokenizer.pad_token = tokenizer.eos_token
+    model.generation_config.do_sample    = False
+    model.generation_config.num_beams    = 1
+    model.generation_config.use_cache    = True
+    model.generation_config.pad_token_id = tokenizer.eos_token_id
+    model.generation_config.temperature  = None
+    model.generation_config.top_p        = None
+
+    if STORY_COMPILE and torch.cuda.is_available():
+        # Fused kernels + CUDA graphs cut the per-token dispatch overhead of batch-1 decode;
+        # dynamic shapes avoid a recompile for every prompt length
+        model.forward = torch.compile(model.forward, mode="reduce-overhead", fullgraph=False, dynamic=True)
+        # Pay the compile cost here rather than on the first user request
+        warmup_ids = tokenizer("warmup", return_tensors="pt").input_ids.to(model.device)
+        with torch.inference_mode():
+            model.generate(warmup_ids, max_new_tokens=4)
+    return tokenizer, model
+
+
+@functools.lru_cache(maxsize=None)
+def get_tokenizer(name: str = MODEL_NAME) -> PreTrainedTokenizerBase:
+    """
+    Returns the fast tokenizer of model `name`, loaded once and without any
+    model weights, for code that only needs to count or inspect tokens.
+    """
+    return AutoTokenizer.from_pretrained(name, use_fast=True)
+
+
+def __getattr__(name: str):
+    # Keeps `from llm_utils import tokenizer, model` working for older call sites
+    if name == "tokenizer":
+        return get_llm()[0]
+    if name == "model":
+        return get_llm()[1]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+@functools.lru_cache(maxsize=None)
+def _template_segments(system: str, user_template: str) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """
+    Renders the chat template once around the `{field}` slots of `user_template`.
+    Returns (fields, segments): the slot names and the constant rendered text
+    between them, with one more segment than fields.
+    """
+    tokenizer, _ = get_llm()
+    fields = tuple(re.findall(r"\{(\w+)\}", user_template))
+    marked = user_template
+    for field in fields:
+        marked = marked.replace("{" + field + "}", "\u00a7" + field + "\u00a7")
+    text = tokenizer.apply_chat_template(
+        [{"role": "system", "content": system}, {"role": "user", "content": marked}],
+        tokenize=False,
+        add_generation_prompt=True
+    )
+    segments = re.split("|".join("\u00a7" + f + "\u00a7" for f in fields), text) if fields else [text]
+    return fields, tuple(segments)
+
+
+@functools.lru_cache(maxsize=None)
+def _format_template(user_template: str) -> str:
+    """
+    `user_template` compiled once into a str.format() string: literal braces are
+    escaped so only the `{field}` slots are substituted.
+    """
+    escaped = user_template.replace("{", "{{").replace("}", "}}")
+    return re.sub(r"\{\{(\w+)\}\}", r"{\1}", escaped)
+
+
+def encode_chat(system: str, user_template: str, **values: str) -> torch.Tensor:
+    """
+    Token ids for a system + user chat turn, identical to apply_chat_template(...,
+    tokenize=True) on the filled-in messages; only the template rendering is cached.
+    """
+    return encode_chat_batch(system, user_template, [values])[0]
+
+
+def encode_chat_batch(system: str, user_template: str, values: List[Dict[str, str]]) -> List[torch.Tensor]:
+    """
+    encode_chat() for several fillings of `user_template`. Each filling is
+    spliced into the cached rendering and the full prompts are tokenized in one
+    batched call, which the fast (Rust) tokenizer encodes in parallel. Whole
+    prompts are tokenized rather than the pieces between slots: SentencePiece
+    tokenizers add a word-start marker at the start of every piece, so joined
+    pieces would not match the ids of the rendered prompt. Returns one (1, L_i)
+    id tensor per filling.
+    """
+    tokenizer, _ = get_llm()
+    fields, segments = _template_segments(system, user_template)
+    texts = []
+    for row_values in values:
+        parts = [segments[0]]
+        for field, segment in zip(fields, segments[1:]):
+            parts.append(row_values[field])
+            parts.append(segment)
+        texts.append("".join(parts))
+    return [
+        torch.tensor([ids], dtype=torch.long)
+        for ids in tokenizer(texts, add_special_tokens=False).input_ids
+    ]
+
+
+def left_pad(rows: List[torch.Tensor], pad_token_id: int) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Left-pads (1, L_i) id tensors into one batch so every row's generation
+    starts at the same column. Returns (input_ids, attention_mask), in pinned
+    host memory on CUDA machines so they can be copied with non_blocking=True.
+    """
+    width = max(row.shape[-1] for row in rows)
+    pin = torch.cuda.is_available()
+    input_ids = torch.full((len(rows), width), pad_token_id, dtype=torch.long, pin_memory=pin)
+    attention_mask = torch.zeros((len(rows), width), dtype=torch.long, pin_memory=pin)
+    for i, row in enumerate(rows):
+        input_ids[i, width - row.shape[-1]:] = row[0]
+        attention_mask[i, width - row.shape[-1]:] = 1
+    return input_ids, attention_mask
+
+
+@functools.lru_cache(maxsize=None)
+def _prefix_ids(system: str, user_template: str) -> torch.Tensor:
+    """
+    Token ids of the constant template text before the first `{field}` slot,
+    minus its last token, which can merge with the start of the slot value.
+    """
+    tokenizer, _ = get_llm()
+    _, segments = _template_segments(system, user_template)
+    ids = tokenizer(segments[0], add_special_tokens=False, return_tensors="pt").input_ids
+    return ids[:, :-1]
+
+
+@functools.lru_cache(maxsize=8)
+def _prefix_kv(system: str, user_template: str) -> DynamicCache:
+    """
+    KV cache of _prefix_ids(system, user_template), computed once per template.
+    """
+    _, model = get_llm()
+    cache = DynamicCache()
+    with torch.inference_mode():
+        model(_prefix_ids(system, user_template).to(model.device), past_key_values=cache, use_cache=True)
+    return cache
+
+
+def generate_with_prefix(system: str, user_template: str, input_ids: torch.Tensor, **gen_kwargs) -> torch.Tensor:
+    """
+    model.generate() for ids built by `encode_chat(system, user_template, ...)`,
+    starting from a copy of the cached prefix KV so only the per-call slot
+    values and the rest of the template are prefilled. Prompts that do not
+    start with the cached prefix ids are generated without it.
+    """
+    _, model = get_llm()
+    prefix = _prefix_ids(system, user_template)
+    n = prefix.shape[-1]
+    with torch.inference_mode():
+        if input_ids.shape[-1] <= n or not torch.equal(input_ids[:, :n], prefix.to(input_ids.device)):
+            return model.generate(input_ids, **gen_kwargs)
+        cache = copy.deepcopy(_prefix_kv(system, user_template))
+        return model.generate(input_ids, past_key_values=cache, **gen_kwargs)
+
+
+def release_cuda_cache() -> None:
+    """
+    Counts one finished generation and returns cached CUDA blocks to the
+    driver every `_EMPTY_EVERY` calls, bounding cache growth without a
+    per-call synchronize.
+    """
+    if next(_N_CALLS) % _EMPTY_EVERY == 0 and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def _counts_in_flight(fn):
+    """
+    Counts the calls of `fn` in _IN_FLIGHT while they run, so single-row calls
+    can tell whether the model is busy and worth waiting for (see _generate_coalesced).
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        global _IN_FLIGHT
+        with _PENDING_LOCK:
+            _IN_FLIGHT += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with _PENDING_LOCK:
+                _IN_FLIGHT -= 1
+    return wrapper
+
+
+def generate_batch(system: str, user_template: str, values: List[Dict[str, str]],
+                   json_schema: Dict = None, **gen_kwargs) -> List[str]:
+    """
+    One left-padded model.generate() over several fillings of `user_template`,
+    so prefill and decoding are shared across them. Returns each row's decoded
+    completion, in input order.
+
+    With `json_schema`, the vLLM backend constrains decoding to that schema;
+    the transformers backend stops each row once it holds a complete JSON value.
+
+    Single-row calls are coalesced with concurrent ones for the same template
+    (see STORY_BATCH_WAIT_MS), so parallel sessions share one generation.
+    Decoding is greedy, so completions are cached by prompt and settings and a
+    repeated row is never generated twice.
+    """
+    try:
+        settings = orjson.dumps([system, user_template, json_schema, sorted(gen_kwargs.items())])
+    except TypeError:
+        # Per-call objects such as stopping criteria: neither cached nor shared across rows
+        return _generate_batch_now(system, user_template, values, json_schema, **gen_kwargs)
+
+    keys = [
+        hashlib.blake2b(settings + b"\0" + orjson.dumps(row, option=orjson.OPT_SORT_KEYS), digest_size=16).digest()
+        for row in values
+    ]
+    with _COMPLETION_LOCK:
+        outputs = [_COMPLETION_CACHE.get(key) for key in keys]
+        for key, output in zip(keys, outputs):
+            if output is not None:
+                _COMPLETION_CACHE.move_to_end(key)
+    missing = [i for i, output in enumerate(outputs) if output is None]
+    if not missing:
+        return outputs
+
+    rows = [values[i] for i in missing]
+    if len(rows) == 1 and STORY_BATCH_WAIT_MS > 0:
+        fresh = [_generate_coalesced(settings, system, user_template, rows[0], json_schema, gen_kwargs)]
+    else:
+        fresh = _generate_batch_now(system, user_template, rows, json_schema, **gen_kwargs)
+    with _COMPLETION_LOCK:
+        for i, output in zip(missing, fresh):
+            outputs[i] = output
+            _COMPLETION_CACHE[keys[i]] = output
+        while len(_COMPLETION_CACHE) > _COMPLETION_CACHE_MAX:
+            _COMPLETION_CACHE.popitem(last=False)
+    return outputs
+
+
+def _generate_coalesced(key: bytes, system: str, user_template: str, row: Dict[str, str],
+                        json_schema: Dict, gen_kwargs: Dict) -> str:
+    """
+    Queues `row` under `key`. The first caller for a key runs everything queued
+    as one batch and hands each caller its own completion. While another
+    generation is in flight (see _counts_in_flight), it first waits
+    STORY_BATCH_WAIT_MS for others to join; an idle process runs the row at once.
+    """
+    future = concurrent.futures.Future()
+    with _PENDING_LOCK:
+        leader = key not in _PENDING_ROWS
+        busy = _IN_FLIGHT > 0
+        _PENDING_ROWS.setdefault(key, []).append((row, future))
+    if leader:
+        if busy:
+            time.sleep(STORY_BATCH_WAIT_MS / 1000)
+        with _PENDING_LOCK:
+            group = _PENDING_ROWS.pop(key)
+        try:
+            outputs = _generate_batch_now(system, user_template, [r for r, _ in group], json_schema, **gen_kwargs)
+        except Exception as e:
+            for _, f in group:
+                f.set_exception(e)
+        else:
+            for (_, f), output in zip(group, outputs):
+                f.set_result(output)
+    return future.result()
+
+
+@_counts_in_flight
+def _generate_batch_now(system: str, user_template: str, values: List[Dict[str, str]],
+                        json_schema: Dict = None, **gen_kwargs) -> List[str]:
+    if LLM_BACKEND == "vllm":
+        return _generate_batch_vllm(system, user_template, values, json_schema, **gen_kwargs)
+
+    tokenizer, model = get_llm()
+    rows = encode_chat_batch(system, user_template, values)
+    input_ids, attention_mask = left_pad(rows, tokenizer.eos_token_id)
+    if json_schema is not None:
+        opener = "[" if json_schema.get("type") == "array" else "{"
+        # Added to any criteria the caller passed, in a new list so theirs is not mutated
+        gen_kwargs["stopping_criteria"] = StoppingCriteriaList([
+            *(gen_kwargs.get("stopping_criteria") or []),
+            JSONCompleteStop(tokenizer, input_ids.shape[-1], opener)
+        ])
+
+    if len(rows) == 1:
+        # Nothing to pad: start from the cached KV of the template prefix instead
+        outputs = generate_with_prefix(
+            system,
+            user_template,
+            input_ids.to(model.device, non_blocking=True),
+            **gen_kwargs
+        )
+    else:
+        with torch.inference_mode():
+            outputs = model.generate(
+                input_ids.to(model.device, non_blocking=True),
+                attention_mask=attention_mask.to(model.device, non_blocking=True),
+                **gen_kwargs
+            )
+    release_cuda_cache()
+
+    # Left padding puts every row's first new token at the same column
+    return tokenizer.batch_decode(outputs[:, input_ids.shape[-1]:], skip_special_tokens=True)
+
+
+@functools.lru_cache(maxsize=1)
+def get_vllm_engine():
+    """
+    Returns the process-wide vLLM engine for MODEL_NAME, created on the first call.
+    """
+    from vllm import LLM  # optional dependency, only needed with STORY_LLM_BACKEND=vllm
+    return LLM(model=MODEL_NAME, dtype="bfloat16", max_num_batched_tokens=8192,
+               gpu_memory_utilization=VLLM_GPU_MEMORY)
+
+
+# generate() kwargs the vLLM path drops: stopping criteria only end a row early,
+# and json_schema's guided decoding already ends JSON rows on the closing bracket
+_VLLM_DROPPED_KWARGS = {"stopping_criteria"}
+
+
+def _generate_batch_vllm(system: str, user_template: str, values: List[Dict[str, str]],
+                         json_schema: Dict = None, max_new_tokens: int = 128, **gen_kwargs) -> List[str]:
+    # Decoding is always greedy (temperature 0); any other generate() setting has no
+    # vLLM mapping here, so it is rejected rather than silently ignored
+    unsupported = set(gen_kwargs) - _VLLM_DROPPED_KWARGS
+    if unsupported:
+        raise TypeError(f"generate_batch() kwargs not supported by the vLLM backend: {sorted(unsupported)}")
+    from vllm import SamplingParams
+    from vllm.sampling_params import GuidedDecodingParams
+    engine = get_vllm_engine()
+    tokenizer = engine.get_tokenizer()
+    prompts = [
+        tokenizer.apply_chat_template(
+            [
+                {"role": "system", "content": system},
+                {"role": "user", "content": _format_template(user_template).format(**row_values)}
+            ],
+            tokenize=False,
+            add_generation_prompt=True
+        )
+        for row_values in values
+    ]
+    guided = GuidedDecodingParams(json=json_schema) if json_schema is not None else None
+    outputs = engine.generate(prompts, SamplingParams(max_tokens=max_new_tokens, temperature=0.0, guided_decoding=guided))
+    return [out.outputs[0].text for out in outputs]
+
+
+def parse_json_prefix(raw: str, opener: str = "{"):
+    """
+    Parses the first JSON value that starts at `opener` in `raw`, ignoring any
+    prose the model wrote after it. Returns None when nothing parses.
+    """
+    start = raw.find(opener)
+    if start < 0:
+        return None
+    # Fast path: orjson over everything up to the last matching closer
+    end = raw.rfind("}" if opener == "{" else "]") + 1
+    if end > start:
+        try:
+            return orjson.loads(raw[start:end])
+        except orjson.JSONDecodeError:
+            pass
+    # Slow path: stdlib decoder stops at the end of the first value on its own
+    try:
+        value, _end = json.JSONDecoder().raw_decode(raw, start)
+    except ValueError:
+        return None
+    return value
+
+
+def tail_tokens(text: str, max_tokens: int, tokenizer_name: str = MODEL_NAME) -> str:
+    """
+    The last `max_tokens` tokens of `text` under the tokenizer of `tokenizer_name`
+    (the model the text is sent to), or `text` unchanged when it already fits.
+    Keeps the most recent part of a long context, starting at a line boundary so
+    the oldest scene kept is never cut mid-sentence.
+    """
+    tokenizer = get_tokenizer(tokenizer_name)
+    ids = tokenizer(text, add_special_tokens=False).input_ids
+    if len(ids) <= max_tokens:
+        return text
+    tail = tokenizer.decode(ids[-max_tokens:], skip_special_tokens=True)
+    # Drop the partial first line, unless the tail is a single line
+    _partial, newline, rest = tail.partition("\n")
+    return rest if newline and rest.strip() else tail
+
+
+@functools.lru_cache(maxsize=1)
+def _get_static_cache() -> StaticCache:
+    _, model = get_llm()
+    return StaticCache(
+        config=model.config,
+        max_batch_size=1,
+        max_cache_len=STATIC_CACHE_LEN,
+        device=model.device,
+        dtype=model.dtype
+    )
+
+
+@_counts_in_flight
+def generate_static(input_ids: torch.Tensor, attention_mask: torch.Tensor = None, **gen_kwargs) -> torch.Tensor:
+    """
+    model.generate() for a single sequence, reusing one pre-allocated KV cache
+    (reset per call) instead of allocating a fresh one every time. Falls back
+    to the default dynamic cache for batches or prompts that would not fit.
+    """
+    _, model = get_llm()
+    needed = input_ids.shape[-1] + gen_kwargs.get("max_new_tokens", 0)
+    if input_ids.shape[0] != 1 or needed > STATIC_CACHE_LEN:
+        with torch.inference_mode():
+            return model.generate(input_ids, attention_mask=attention_mask, **gen_kwargs)
+
+    with _STATIC_CACHE_LOCK:
+        cache = _get_static_cache()
+        cache.reset()
+        with torch.inference_mode():
+            return model.generate(input_ids, attention_mask=attention_mask, past_key_values=cache, **gen_kwargs)
+
+
+class JSONCompleteStop(StoppingCriteria):
+    """
+    Stops each row once its generated text holds a complete JSON value.
+
+    Only the tokens added since the previous call are decoded and scanned, keeping
+    a per-row bracket depth (ignoring brackets inside strings) from the first
+    `opener` on, so the cost per step stays constant as the output grows.
+    """
+
+    def __init__(self, tokenizer, prompt_len: int, opener: str = "{"):
+        self.tokenizer  = tokenizer
+        self.prompt_len = prompt_len
+        self.opener     = opener
+        self._seen      = prompt_len
+        self._rows      = None  # per row: [depth, started, in_string, escaped, done]
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        if self._rows is None:
+            self._rows = [[0, False, False, False, False] for _ in range(input_ids.shape[0])]
+        pieces = self.tokenizer.batch_decode(input_ids[:, self._seen:], skip_special_tokens=True)
+        self._seen = input_ids.shape[-1]
+        for row, piece in zip(self._rows, pieces):
+            if not row[4]:
+                self._scan(row, piece)
+        return torch.tensor([row[4] for row in self._rows], dtype=torch.bool, device=input_ids.device)
+
+    def _scan(self, row: list, piece: str) -> None:
+        depth, started, in_string, escaped, done = row
+        for ch in piece:
+            if not started:
+                if ch != self.opener:
+                    continue
+                started = True
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif ch == "\\":
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch in "{[":
+                depth += 1
+            elif ch in "}]":
+                depth -= 1
+                if depth == 0:
+                    done = True
+                    break
+        row[:] = [depth, started, in_string, escaped, done]
+
+
+class WordCountStop(StoppingCriteria):
+    """
+    Stops each row once its generated text has started more than `limit` words.
+
+    Words are counted from the word-initial markers of the new tokens
+    (SentencePiece "\u2581", byte-level BPE "\u0120"), so each step only looks at
+    the token just generated. The prompt length is taken from the first call,
+    which generate() makes right after the first new token. Uses get_tokenizer(),
+    so counting words never loads the model weights.
+    """
+
+    _WORD_START = ("\u2581", "\u0120")
+
+    def __init__(self, limit: int):
+        self.limit     = limit
+        self._seen     = None
+        self._counts   = None
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        if self._counts is None:
+            self._seen   = input_ids.shape[-1] - 1
+            self._counts = [0] * input_ids.shape[0]
+        for i, row in enumerate(input_ids[:, self._seen:].tolist()):
+            tokens = get_tokenizer().convert_ids_to_tokens(row)
+            self._counts[i] += sum(1 for tok in tokens if tok.startswith(self._WORD_START))
+        self._seen = input_ids.shape[-1]
+        return torch.tensor([n > self.limit for n in self._counts], dtype=torch.bool, device=input_ids.device)
+
 
-# Load **once** at import time
-tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-model     = AutoModelForCausalLM.from_pretrained(
-    MODEL_NAME,
-    device_map="auto",
-    torch_dtype=torch.bfloat16
-)
-model.eval()
-
-# Optionally wrap generation logic here
-def generate_completion(inputs_tensor, **gen_kwargs):
-    with torch.no_grad():
-        return model.generate(inputs_tensor, **gen_kwargs)
\ No newline at end of file
+def closing_eos_ids(tokenizer, closer: str = "}") -> List[int]:
+    """EOS ids plus the id of `closer`, so a bare closing bracket also ends generation."""
+    eos_ids = [tokenizer.eos_token_id]
+    closer_id = tokenizer.convert_tokens_to_ids(closer)
+    if closer_id is not None and closer_id != tokenizer.unk_token_id:
+        eos_ids.append(closer_id)
+    return eos_ids
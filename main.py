@@ -1,25 +1,96 @@
 # orchestrator.py
 
 import os
-import base64
-from typing import Optional, Dict, Any
+import asyncio
+import concurrent.futures
+import functools
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List
+from async_utils import run_async_safely, submit_async
+from llm_utils import tail_tokens
 from store_facts import StoryState
-from Tools.story_generator import StoryGeneratorTool
-from Tools.extract_facts import ExtractFactsTool
-from Tools.build_world import build_world
-from Tools.generate_choices import generate_choices
+from Tools.story_generator import MODEL_NAME as STORY_MODEL, StoryGeneratorTool
+from Tools.scene_bundle import SceneBundleTool
 from Tools.image_agent import generate_image
+from Tools.imagedecider import check_significant_change
 from Tools.audio_agent import generate_voice_narration  # your TTS tool
 
-# No consistency or change-checking for now
+# No consistency checking for now; change-checking only gates image generation
 
 # Output directories
 AUDIO_DIR = "outputs/audio"
 IMAGE_DIR = "outputs/images"
+# Prompt budget for the scene context; longer contexts keep only their most recent tokens
+CONTEXT_MAX_TOKENS = 1024
+# Start writing the scenes for the offered choices while the user is still deciding ("0" turns it off)
+STORY_PREFETCH = os.getenv("STORY_PREFETCH", "1") != "0"
+# At most this many prefetched scenes are generated at once, across all stories
+PREFETCH_CONCURRENCY = 4
 
-# Ensure output dirs exist
-os.makedirs(AUDIO_DIR, exist_ok=True)
-os.makedirs(IMAGE_DIR, exist_ok=True)
+# Tools are stateless, so one instance of each serves every step
+_SCENE_TOOL = StoryGeneratorTool()
+_BUNDLE_TOOL = SceneBundleTool()
+
+# Prefetched next scenes: context hash -> {choice: Future}, oldest context first
+_PREFETCHED: "OrderedDict[bytes, Dict[str, concurrent.futures.Future]]" = OrderedDict()
+_PREFETCHED_MAX = 64
+_PREFETCHED_LOCK = threading.Lock()
+_PREFETCH_LIMIT: Optional[asyncio.Semaphore] = None
+
+
+@functools.lru_cache(maxsize=None)
+def _ensure_dir(path: str) -> None:
+    """Create an output directory on first use (once per process)."""
+    os.makedirs(path, exist_ok=True)
+
+
+def _prefetch_key(context: str) -> bytes:
+    return hashlib.blake2b(context.encode(), digest_size=16).digest()
+
+
+async def _prefetch_one(context: str, choice: str) -> str:
+    # The semaphore is created on, and only used from, the shared async_utils loop
+    global _PREFETCH_LIMIT
+    if _PREFETCH_LIMIT is None:
+        _PREFETCH_LIMIT = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+    async with _PREFETCH_LIMIT:
+        return await _SCENE_TOOL.aforward(context=context, last_choice=choice)
+
+
+def _prefetch_scenes(context: str, choices: List[str]) -> None:
+    """
+    Generates the scene that would follow each of `choices` in the background, so
+    the next advance_story() can pick one up instead of waiting on the story model.
+    """
+    futures = {
+        choice: submit_async(_prefetch_one(context, choice))
+        for choice in choices
+    }
+    with _PREFETCHED_LOCK:
+        _PREFETCHED[_prefetch_key(context)] = futures
+        while len(_PREFETCHED) > _PREFETCHED_MAX:
+            for future in _PREFETCHED.popitem(last=False)[1].values():
+                future.cancel()
+
+
+def _take_prefetched_scene(context: str, choice: str) -> Optional[str]:
+    """
+    The prefetched scene for `choice` in `context`, or None if there is none (or it
+    failed). The branches that were not chosen are cancelled.
+    """
+    with _PREFETCHED_LOCK:
+        futures = _PREFETCHED.pop(_prefetch_key(context), {})
+    future = futures.pop(choice, None)
+    for other in futures.values():
+        other.cancel()
+    if future is None:
+        return None
+    try:
+        return future.result()
+    except Exception:
+        return None
 
 
 def advance_story(
@@ -28,53 +99,83 @@ def advance_story(
     last_choice: Optional[str] = None
 ) -> Dict[str, Any]:
     """
-    Runs one step of the story pipeline without consistency or change checks:
+    Runs one step of the story pipeline without consistency checks:
       1. Generate scene
-      2. Extract facts
-      3. Update state & build world meta
-      4. Generate choices
-      5. Generate and save audio (TTS)
-      6. Generate and save image
-      7. Return all data
+      2. Extract facts, generate choices and build world meta (one LLM call)
+      3. Update state
+      4. Generate and save audio (TTS, concurrently with 2-3)
+      5. Generate and save image (as soon as 3 is done), or reuse the previous
+         one when the setting did not change significantly
+      6. Return all data
     """
-    # 1) Generate scene
-    scene_tool = StoryGeneratorTool()
+    # 1) Generate scene, unless it was prefetched when the previous step offered this choice
     scene_args = {
-        "context": state.get_context_window(n=3),
+        "context": tail_tokens(state.get_context_window(n=3), CONTEXT_MAX_TOKENS, STORY_MODEL),
         "initial_prompt": initial_prompt,
         "last_choice": last_choice,
     }
-    scene_text = scene_tool.forward(**scene_args)
+    scene_text = None
+    if last_choice and not initial_prompt:
+        scene_text = _take_prefetched_scene(scene_args["context"], last_choice)
+    if scene_text is None:
+        scene_text = _SCENE_TOOL.forward(**scene_args)
 
-    # 2) Extract facts
-    fact_tool = ExtractFactsTool()
-    new_facts = fact_tool.forward(scene_text)
+    # 2-5) Everything below depends only on the scene, facts or world meta, so the
+    #      steps run as a small task graph: the voice model, the LLM and the
+    #      diffusion model each work as soon as their inputs are ready, and each
+    #      output file is written from its own worker thread
+    scene_no = len(state.scene_history) + 1
+    audio_path = os.path.join(AUDIO_DIR, f"scene_{scene_no}.wav")
 
-    # 3) Update state & build world metadata
-    state.update_facts(new_facts)
-    state.append_scene(scene_text)
-    world_meta = build_world(state.facts)
-    state.update_world_meta(world_meta)
+    def _render_image(setting: str) -> str:
+        # Images are named by their setting, so a setting seen before (in any story)
+        # reuses its file instead of running diffusion again. Placeholders and images
+        # for an empty setting are saved per scene instead, so they are never reused
+        image_path = None
+        if setting:
+            digest = hashlib.blake2b(setting.encode(), digest_size=16).hexdigest()
+            image_path = os.path.join(IMAGE_DIR, f"{digest}.png")
+            if os.path.exists(image_path):
+                return image_path
+        image = generate_image(setting)
+        if image_path is None or image.info.get("placeholder"):
+            image_path = os.path.join(IMAGE_DIR, f"scene_{scene_no}.png")
+        _ensure_dir(IMAGE_DIR)
+        image.save(image_path)
+        return image_path
 
-    # 4) Generate next-step choices
-    choices = generate_choices(scene_text, state.facts)
+    async def _run_step_graph():
+        # 4) TTS needs only the scene text: start it alongside (2) the facts/choices/world bundle
+        audio_task = asyncio.create_task(asyncio.to_thread(generate_voice_narration, scene_text, audio_path))
+        bundle = await asyncio.to_thread(_BUNDLE_TOOL.forward, scene_text, state.facts)
+        choices, world_meta = bundle["choices"], bundle["world"]
 
-    # 5) Generate and save audio (TTS)
-    tts_tool = generate_voice_narration
-    audio_bytes = tts_tool(scene_text)
-    audio_path = os.path.join(AUDIO_DIR, f"scene_{len(state.scene_history)}.mp3")
-    with open(audio_path, "wb") as f:
-        f.write(audio_bytes)
-    state.record_audio(audio_path)
+        # 3) Update state
+        state.update_facts(bundle["facts"])
+        state.append_scene(scene_text)
+
+        # 5) The image only waits for the world meta, and reuses the previous one
+        #    when the setting did not change significantly since the last illustrated scene
+        #    (the check runs a sentence encoder, so it stays off the shared loop)
+        setting = world_meta.get("setting_description", "")
+        if state.image_paths and state.world_meta and not await asyncio.to_thread(
+            check_significant_change, state.world_meta[-1].get("setting_description", ""), setting
+        ):
+            image_task = asyncio.create_task(asyncio.sleep(0, result=state.image_paths[-1]))
+        else:
+            image_task = asyncio.create_task(asyncio.to_thread(_render_image, setting))
+        _, image_path = await asyncio.gather(audio_task, image_task)
+        return world_meta, choices, image_path
 
-    # 6) Generate and save image
-    img_bytes = generate_image(world_meta.get("setting_description", ""))
-    image_path = os.path.join(IMAGE_DIR, f"scene_{len(state.scene_history)}.png")
-    with open(image_path, "wb") as f:
-        f.write(img_bytes)
+    world_meta, choices, image_path = run_async_safely(_run_step_graph())
+    state.update_world_meta(world_meta)
+    state.record_audio(audio_path)
     state.record_image(image_path)
 
-    # 7) Package and return
+    if STORY_PREFETCH and choices:
+        _prefetch_scenes(tail_tokens(state.get_context_window(n=3), CONTEXT_MAX_TOKENS, STORY_MODEL), choices)
+
+    # 6) Package and return
     return {
         "scene_text":    scene_text,
         "choices":       choices,
@@ -1,43 +1,114 @@
 # story_state.py
 
 from typing import List, Dict, Any
-import json
+import orjson
 
 
-from typing import List, Dict, Any
-import json
+class SceneHistory:
+    """
+    Per-scene extracted facts stored column-wise: one list per fact key, with
+    row i of every column belonging to scene i. Aggregations (e.g. joining the
+    last N `events`) then work on a single list instead of a list of dicts.
+    """
+
+    COLUMNS = (
+        "location",
+        "weather",
+        "time_of_day",
+        "main_character",
+        "npc_states",
+        "inventory_items",
+        "events",
+    )
+    __slots__ = COLUMNS
+
+    def __init__(self):
+        self.location: List[Any] = []
+        self.weather: List[Any] = []
+        self.time_of_day: List[Any] = []
+        self.main_character: List[Any] = []
+        self.npc_states: List[Dict[str, Any]] = []
+        self.inventory_items: List[List[str]] = []
+        self.events: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def append(self, facts: Dict[str, Any]) -> None:
+        """
+        Push one scene's facts onto every column (missing keys become None).
+        """
+        for key in self.COLUMNS:
+            getattr(self, key).append(facts.get(key))
+
+    def recent_events(self, n: int) -> str:
+        """
+        The `events` summaries of the last `n` scenes, one per line.
+        """
+        return "\n".join(e for e in self.events[-n:] if e)
+
+    def to_dict(self) -> Dict[str, List[Any]]:
+        return {key: getattr(self, key) for key in self.COLUMNS}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, List[Any]]) -> "SceneHistory":
+        obj = cls()
+        for key in cls.COLUMNS:
+            setattr(obj, key, list(data.get(key, [])))
+        return obj
+
 
 class StoryState:
     """
     Holds the evolving state of the story, including:
       - scene_history: list of scene texts in order
       - facts: dictionary of structured facts extracted so far
+      - fact_history: the facts extracted from each scene, stored column-wise
       - npc_states: dictionary tracking NPC-specific state (e.g., status, location)
       - world_meta: list of world-building metadata per scene
       - audio_paths: list of file paths for generated TTS audio
       - image_paths: list of file paths for generated images
     """
 
+    # One instance per live session: no per-instance __dict__
+    __slots__ = (
+        "scene_history",
+        "facts",
+        "fact_history",
+        "npc_states",
+        "world_meta",
+        "audio_paths",
+        "image_paths",
+        "_context_cache",
+    )
+
     def __init__(self):
         self.scene_history: List[str] = []
         self.facts: Dict[str, Any] = {}
+        self.fact_history = SceneHistory()
         self.npc_states: Dict[str, Any] = {}
         self.world_meta: List[Dict[str, Any]] = []
         self.audio_paths: List[str] = []
         self.image_paths: List[str] = []
+        # get_context_window() results by n; cleared whenever scenes or facts change
+        self._context_cache: Dict[int, str] = {}
 
     def update_facts(self, new_facts: Dict[str, Any]) -> None:
         """
-        Merge new_facts into the existing facts dictionary.
+        Merge new_facts into the existing facts dictionary and record them
+        in the per-scene fact history.
         """
         for key, value in new_facts.items():
             self.facts[key] = value
+        self.fact_history.append(new_facts)
+        self._context_cache.clear()
 
     def append_scene(self, scene_text: str) -> None:
         """
         Add a newly generated scene to the history.
         """
         self.scene_history.append(scene_text)
+        self._context_cache.clear()
 
     def update_world_meta(self, world: Dict[str, Any]) -> None:
         """
@@ -60,10 +131,15 @@ class StoryState:
     def get_context_window(self, n: int) -> str:
         """
         Return a string containing the last `n` scenes plus the current facts as JSON.
+        Cached until the next update_facts() or append_scene().
         """
+        if n in self._context_cache:
+            return self._context_cache[n]
+
         last_scenes = self.scene_history[-n:]
         scenes_text = "\n".join(last_scenes)
-        facts_json = json.dumps(self.facts, indent=2)
+        # Compact JSON: the context goes into an LLM prompt, where indentation only costs tokens
+        facts_json = orjson.dumps(self.facts).decode()
 
         context_parts = []
         if scenes_text:
@@ -71,7 +147,9 @@ class StoryState:
         if self.facts:
             context_parts.append(f"Current facts:\n{facts_json}")
 
-        return "\n\n".join(context_parts)
+        context = "\n\n".join(context_parts)
+        self._context_cache[n] = context
+        return context
 
     def to_dict(self) -> Dict[str, Any]:
         """
@@ -80,6 +158,7 @@ class StoryState:
         return {
             "scene_history": self.scene_history,
             "facts": self.facts,
+            "fact_history": self.fact_history.to_dict(),
             "npc_states": self.npc_states,
             "world_meta": self.world_meta,
             "audio_paths": self.audio_paths,
@@ -94,6 +173,7 @@ class StoryState:
         obj = cls()
         obj.scene_history = data.get("scene_history", [])
         obj.facts = data.get("facts", {})
+        obj.fact_history = SceneHistory.from_dict(data.get("fact_history", {}))
         obj.npc_states = data.get("npc_states", {})
         obj.world_meta = data.get("world_meta", [])
         obj.audio_paths = data.get("audio_paths", [])
@@ -0,0 +1,46 @@
+from collections import OrderedDict
+import orjson
+import pytest
+import Tools.build_world as build_world_module
+from Tools.build_world import build_world
+
+WORLD = {"setting_description": "A misty forest.", "flora": ["fern"], "fauna": ["owl"], "ambiance": ["rain"]}
+FACTS = {"location": "forest", "weather": "rainy", "time_of_day": "evening", "events": "The hero arrives."}
+
+@pytest.fixture
+def backend(monkeypatch):
+    """Fake backend that counts its calls and returns `backend.reply`."""
+    fake = type("FakeBackend", (), {"calls": 0, "reply": orjson.dumps(WORLD).decode()})()
+    def generate_world_json(facts_json):
+        fake.calls += 1
+        return fake.reply
+    monkeypatch.setattr(build_world_module, "get_backend", lambda name: generate_world_json)
+    monkeypatch.setattr(build_world_module, "_WORLD_CACHE", OrderedDict())
+    return fake
+
+def test_same_setting_reuses_world(backend):
+    assert build_world(facts=FACTS) == WORLD
+    assert build_world(facts={**FACTS, "events": "Something else happens."}) == WORLD
+    assert backend.calls == 1
+
+def test_changed_setting_generates_again(backend):
+    build_world(facts=FACTS)
+    build_world(facts={**FACTS, "weather": "sunny"})
+    assert backend.calls == 2
+
+def test_no_location_keys_by_all_facts(backend):
+    facts = {**FACTS, "location": None}
+    build_world(facts=facts)
+    build_world(facts={**facts, "events": "Something else happens."})
+    assert backend.calls == 2
+
+def test_failed_reply_returns_defaults_and_is_not_cached(backend):
+    backend.reply = "Sorry, I cannot help with that."
+    assert build_world(facts=FACTS) == {"setting_description": "", "flora": [], "fauna": [], "ambiance": []}
+    backend.reply = orjson.dumps(WORLD).decode()
+    assert build_world(facts=FACTS) == WORLD
+    assert backend.calls == 2
+
+def test_cached_world_is_a_copy(backend):
+    build_world(facts=FACTS)["flora"].append("moss")
+    assert build_world(facts=FACTS) == WORLD
@@ -0,0 +1,23 @@
+from Tools.extract_facts import _with_fact_defaults
+
+DEFAULTS = {
+    "location": None,
+    "weather": None,
+    "time_of_day": None,
+    "main_character": None,
+    "npc_states": {},
+    "inventory_items": [],
+    "events": ""
+}
+
+def test_parsed_facts_override_defaults():
+    facts = _with_fact_defaults({"location": "forest", "inventory_items": ["lamp"]})
+    assert facts == {**DEFAULTS, "location": "forest", "inventory_items": ["lamp"]}
+
+def test_unparsed_reply_gives_defaults():
+    assert _with_fact_defaults(None) == DEFAULTS
+    assert _with_fact_defaults(["not", "a", "dict"]) == DEFAULTS
+
+def test_default_containers_are_fresh():
+    _with_fact_defaults(None)["npc_states"]["owl"] = {"status": "awake"}
+    assert _with_fact_defaults(None)["npc_states"] == {}
@@ -0,0 +1,135 @@
+from collections import OrderedDict
+from types import SimpleNamespace
+import torch
+import llm_utils
+from llm_utils import JSONCompleteStop, left_pad, parse_json_prefix, tail_tokens
+
+class CharTokenizer:
+    """One token per character (id = code point), so tests need no model files."""
+    eos_token_id = 0
+    def __call__(self, text, add_special_tokens=False):
+        return SimpleNamespace(input_ids=[ord(ch) for ch in text])
+    def decode(self, ids, skip_special_tokens=True):
+        return "".join(chr(i) for i in ids)
+    def batch_decode(self, rows, skip_special_tokens=True):
+        return [self.decode(row.tolist()) for row in rows]
+
+def _ids(text):
+    return [ord(ch) for ch in text]
+
+def _run_stop(stop, prompt, completions):
+    """Feeds `completions` to `stop` one character per step; returns the step each row stopped at."""
+    stopped_at = [None] * len(completions)
+    width = max(len(c) for c in completions)
+    for step in range(1, width + 1):
+        rows = [_ids(prompt + c[:step].ljust(step)) for c in completions]
+        done = stop(torch.tensor(rows), None).tolist()
+        for i, flag in enumerate(done):
+            if flag and stopped_at[i] is None:
+                stopped_at[i] = step
+    return stopped_at
+
+# parse_json_prefix
+
+def test_parse_json_prefix_ignores_surrounding_text():
+    assert parse_json_prefix('Sure! {"a": 1} Hope this helps.') == {"a": 1}
+
+def test_parse_json_prefix_stops_at_first_value():
+    assert parse_json_prefix('{"a": 1} and {"b": 2}') == {"a": 1}
+
+def test_parse_json_prefix_array_opener():
+    assert parse_json_prefix('Choices: ["Go left", "Go right"]', "[") == ["Go left", "Go right"]
+
+def test_parse_json_prefix_returns_none_when_nothing_parses():
+    assert parse_json_prefix("no json here") is None
+    assert parse_json_prefix('{"a": ') is None
+
+# JSONCompleteStop
+
+def test_json_complete_stop_per_row():
+    stop = JSONCompleteStop(CharTokenizer(), prompt_len=2, opener="{")
+    completions = ['{"a": 1} tail', 'x {"b": {"c": [1]}}']
+    assert _run_stop(stop, "P:", completions) == [len('{"a": 1}'), len('x {"b": {"c": [1]}}')]
+
+def test_json_complete_stop_ignores_brackets_in_strings():
+    stop = JSONCompleteStop(CharTokenizer(), prompt_len=1, opener="{")
+    text = '{"a": "}{ \\" }"}'
+    assert _run_stop(stop, ">", [text]) == [len(text)]
+
+def test_json_complete_stop_array_opener():
+    stop = JSONCompleteStop(CharTokenizer(), prompt_len=1, opener="[")
+    text = '["a", "b"] extra'
+    assert _run_stop(stop, ">", [text]) == [len('["a", "b"]')]
+
+# tail_tokens
+
+def test_tail_tokens_keeps_text_that_fits(monkeypatch):
+    monkeypatch.setattr(llm_utils, "get_tokenizer", lambda name=None: CharTokenizer())
+    assert tail_tokens("aaa\nbbb\nccc", 11) == "aaa\nbbb\nccc"
+
+def test_tail_tokens_drops_partial_first_line(monkeypatch):
+    monkeypatch.setattr(llm_utils, "get_tokenizer", lambda name=None: CharTokenizer())
+    # The last 6 tokens are "bb\nccc"; the cut-off "bb" line is dropped
+    assert tail_tokens("aaa\nbbb\nccc", 6) == "ccc"
+
+def test_tail_tokens_keeps_single_line_tail(monkeypatch):
+    monkeypatch.setattr(llm_utils, "get_tokenizer", lambda name=None: CharTokenizer())
+    assert tail_tokens("abcdefgh", 3) == "fgh"
+
+# left_pad / generate_batch alignment
+
+def test_left_pad_right_aligns_rows():
+    input_ids, attention_mask = left_pad([torch.tensor([[1, 2, 3]]), torch.tensor([[4]])], pad_token_id=0)
+    assert input_ids.tolist() == [[1, 2, 3], [0, 0, 4]]
+    assert attention_mask.tolist() == [[1, 1, 1], [0, 0, 1]]
+
+class AppendModel:
+    """Stands in for model.generate(): appends a fixed completion to every row."""
+    device = torch.device("cpu")
+    def __init__(self, completions):
+        self.completions = completions
+    def generate(self, input_ids, attention_mask=None, **kwargs):
+        new = torch.tensor([_ids(c) for c in self.completions])
+        return torch.cat([input_ids, new], dim=1)
+
+def test_generate_batch_decodes_each_rows_new_tokens(monkeypatch):
+    monkeypatch.setattr(llm_utils, "get_llm", lambda: (CharTokenizer(), AppendModel(["AB", "CD"])))
+    monkeypatch.setattr(
+        llm_utils, "encode_chat_batch",
+        lambda system, template, values: [torch.tensor([_ids(v["x"])]) for v in values]
+    )
+    outputs = llm_utils._generate_batch_now("sys", "{x}", [{"x": "long prompt"}, {"x": "p"}], max_new_tokens=2)
+    assert outputs == ["AB", "CD"]
+
+# generate_batch completion cache
+
+def _fake_generation(monkeypatch):
+    """Replaces the model call with one that records the rows it is asked to generate."""
+    calls = []
+    def fake(system, user_template, values, json_schema=None, **gen_kwargs):
+        calls.append([row["x"] for row in values])
+        return [f"out-{row['x']}" for row in values]
+    monkeypatch.setattr(llm_utils, "_generate_batch_now", fake)
+    monkeypatch.setattr(llm_utils, "_COMPLETION_CACHE", OrderedDict())
+    return calls
+
+def test_generate_batch_caches_completions_per_row(monkeypatch):
+    calls = _fake_generation(monkeypatch)
+    assert llm_utils.generate_batch("sys", "{x}", [{"x": "1"}, {"x": "2"}], max_new_tokens=5) == ["out-1", "out-2"]
+    assert llm_utils.generate_batch("sys", "{x}", [{"x": "2"}, {"x": "3"}], max_new_tokens=5) == ["out-2", "out-3"]
+    assert calls == [["1", "2"], ["3"]]
+
+def test_generate_batch_cache_key_includes_settings(monkeypatch):
+    calls = _fake_generation(monkeypatch)
+    llm_utils.generate_batch("sys", "{x}", [{"x": "1"}, {"x": "2"}], max_new_tokens=5)
+    llm_utils.generate_batch("sys", "{x}", [{"x": "1"}, {"x": "2"}], max_new_tokens=6)
+    llm_utils.generate_batch("other", "{x}", [{"x": "1"}, {"x": "2"}], max_new_tokens=5)
+    assert len(calls) == 3
+
+def test_generate_batch_skips_cache_for_unserializable_kwargs(monkeypatch):
+    calls = _fake_generation(monkeypatch)
+    criteria = object()
+    for _ in range(2):
+        llm_utils.generate_batch("sys", "{x}", [{"x": "1"}], stopping_criteria=criteria)
+    assert calls == [["1"], ["1"]]
+    assert not llm_utils._COMPLETION_CACHE
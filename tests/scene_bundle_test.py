@@ -0,0 +1,24 @@
+from Tools.scene_bundle import SceneBundleTool
+
+def test_parse_full_bundle():
+    raw = (
+        '{"facts": {"location": "cave"}, "choices": ["Go in", "Leave"], '
+        '"world": {"setting_description": "A dark cave.", "flora": [], "fauna": ["bat"], "ambiance": []}}'
+    )
+    bundle = SceneBundleTool._parse(raw)
+    assert bundle["facts"]["location"] == "cave"
+    assert bundle["facts"]["events"] == ""
+    assert bundle["choices"] == ["Go in", "Leave"]
+    assert bundle["world"]["fauna"] == ["bat"]
+
+def test_parse_falls_back_per_part():
+    bundle = SceneBundleTool._parse('{"facts": {"weather": "rainy"}, "choices": ["Only one"]}')
+    assert bundle["facts"]["weather"] == "rainy"
+    assert bundle["choices"] == ["Continue forward", "Turn back"]
+    assert bundle["world"] == {"setting_description": "", "flora": [], "fauna": [], "ambiance": []}
+
+def test_parse_unparsable_reply():
+    bundle = SceneBundleTool._parse("I could not do that.")
+    assert bundle["facts"]["location"] is None
+    assert bundle["choices"] == ["Continue forward", "Turn back"]
+    assert bundle["world"]["setting_description"] == ""
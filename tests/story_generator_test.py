@@ -1,19 +1,26 @@
 # 2. Write test code to file
+from types import SimpleNamespace
 import pytest
 from Tools.story_generator import StoryGeneratorTool
 
+def _chunk(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
 class DummyClient:
     def __init__(self, response):
         self.response = response
         self.last_messages = None
-    def chat(self, messages, temperature, max_tokens):
+    def chat_completion(self, model, messages, temperature, max_tokens, stream):
         self.last_messages = messages
-        return self.response
+        # Stream the response word by word, with an empty keep-alive chunk in between
+        words = self.response.split(" ")
+        chunks = [_chunk(words[0])] + [_chunk(" " + w) for w in words[1:]]
+        return iter(chunks[:1] + [_chunk(None)] + chunks[1:])
 
 @pytest.fixture(autouse=True)
 def patch_hf_client(monkeypatch):
     dummy = DummyClient("dummy response")
-    monkeypatch.setattr(StoryGeneratorTool, "_get_hf_client", lambda self: dummy)
+    monkeypatch.setattr(StoryGeneratorTool, "_get_client", lambda *_: dummy)
     return dummy
 
 def test_both_initial_and_last_choice_raises():
@@ -37,4 +44,8 @@ def test_context_only(patch_hf_client):
     dummy = patch_hf_client
     tool = StoryGeneratorTool()
     result = tool.forward(context="Only context here")
-    assert result == "dummy response"
\ No newline at end of file
+    assert result == "dummy response"
+
+def test_stream_yields_chunks(patch_hf_client):
+    tool = StoryGeneratorTool()
+    assert list(tool.stream(context="Only context here")) == ["dummy", " response"]
@@ -0,0 +1,17 @@
+from Tools.validate_consistency import validate_consistency
+
+OLD_FACTS = {"location": "forest", "weather": "rainy", "time_of_day": "evening"}
+
+def test_matching_facts_are_consistent():
+    assert validate_consistency(OLD_FACTS, dict(OLD_FACTS)) is True
+
+def test_contradicting_fact_is_inconsistent():
+    assert validate_consistency(OLD_FACTS, {**OLD_FACTS, "weather": "sunny"}) is False
+
+def test_missing_or_null_keys_are_consistent():
+    assert validate_consistency(OLD_FACTS, {"location": "forest"}) is True
+    assert validate_consistency(OLD_FACTS, {**OLD_FACTS, "time_of_day": None}) is True
+    assert validate_consistency({"location": None}, {"location": "cave"}) is True
+
+def test_non_core_keys_are_ignored():
+    assert validate_consistency({**OLD_FACTS, "events": "a"}, {**OLD_FACTS, "events": "b"}) is True